@@ -0,0 +1,206 @@
+'''End to end benchmark of the pipeline on synthetic data (see cycle_safety.synthetic). Times and memory-profiles each stage and saves
+the results as JSON so they can be compared between commits:
+
+    python benchmarks/benchmark.py --casualties 100000
+    python benchmarks/benchmark.py --casualties 100000 --compare benchmarks/results/<earlier run>.json
+
+The synthetic data is generated once per scale (and seed) into benchmarks/data/ and reused. Each stage is timed over --repeat runs of
+the whole pipeline (the fastest run is reported), then the pipeline is run once more under tracemalloc to record the peak memory
+allocated by each stage.'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))                                    # Run from a checkout without installing the package
+
+from cycle_safety import __version__                                          # noqa: E402
+from cycle_safety import counts, decoding, export, interpolation, loading, matching, synthetic   # noqa: E402
+
+
+STAGES = ['load','decode','knn','interpolate','merge','export']
+
+
+def stages(path, year, out, k=matching.K_NEAREST):
+
+    '''The pipeline broken into the stages which are timed, each calling the pipeline's own stage function on the results so far (a dict it adds to):
+    * load - load & clean the Traffic Counts, build the CountIndex and load the Casualties
+    * decode - decode the STATS19 codes (decode_casualties)
+    * knn - match each Casualty with its k nearest Count Points (knn_match)
+    * interpolate - gather the matched Count Points' traffic counts and weight them into the estimates (interpolate_counts)
+    * merge - join the estimates on to every Casualty (merge_casualties)
+    * export - write the csv file (export_casualties)'''
+
+    def load(r):
+        r['index'] = counts.CountIndex(counts.prepare_counts(loading.load_counts(path, [year])))
+        r['df_cas'] = loading.load_casualties(path, year)
+
+    def decode(r):
+        r['df_cas'] = decoding.decode_casualties(r['df_cas'])
+
+    def knn(r):
+        r['df_knn'] = matching.knn_match(r['df_cas'], r['index'], k)
+
+    def interpolate(r):
+        r['df_out'] = interpolation.interpolate_counts(r['df_knn'], r['index'], k)
+
+    def merge(r):
+        r['df_cas_out'] = export.merge_casualties(r['df_cas'], r['df_out'])
+
+    def write(r):
+        export.export_casualties(r['df_cas_out'], out, None)
+
+    return list(zip(STAGES, [load, decode, knn, interpolate, merge, write]))
+
+
+def rows(r):
+
+    '''Sizes of the main tables of a pipeline run.'''
+
+    return {'df_tc': len(r['index'].df_tc), 'df_cas': len(r['df_cas']), 'df_knn': len(r['df_knn']), 'df_out': len(r['df_out']),
+            'df_cas_out': len(r['df_cas_out'])}
+
+
+def time_run(path, year, out):
+
+    '''Runs the pipeline once, returning the wall & cpu seconds of each stage and the results.'''
+
+    r, times = {}, {}
+    for name, stage in stages(path, year, out):
+        wall, cpu = time.perf_counter(), time.process_time()
+        stage(r)
+        times[name] = {'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu}
+
+    return times, r
+
+
+def memory_run(path, year, out):
+
+    '''Runs the pipeline once under tracemalloc, returning the peak MB allocated during each stage
+    (on top of what was already allocated when the stage started) and the MB still allocated after it.'''
+
+    r, memory = {}, {}
+    tracemalloc.start()
+    for name, stage in stages(path, year, out):
+        if hasattr(tracemalloc, 'reset_peak'):                               # Python 3.9+, before that the peak covers the earlier stages too
+            tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        stage(r)
+        current, peak = tracemalloc.get_traced_memory()
+        memory[name] = {'peak_mb': (peak - start) / 2 ** 20, 'retained_mb': current / 2 ** 20}
+    tracemalloc.stop()
+
+    return memory
+
+
+def git_commit():
+
+    '''The current commit (and whether the tree has uncommitted changes), or None outside a git checkout.'''
+
+    try:
+        commit = subprocess.run(['git','rev-parse','HEAD'], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git','status','--porcelain','--untracked-files=no'], cwd=HERE, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+    return commit, dirty
+
+
+def versions():
+
+    '''Versions of the packages the pipeline depends on.'''
+
+    import numpy, pandas, pyproj, scipy
+
+    return {'cycle_safety': __version__, 'numpy': numpy.__version__, 'pandas': pandas.__version__, 'scipy': scipy.__version__, 'pyproj': pyproj.__version__}
+
+
+def benchmark(casualties, year=2015, count_points=22000, seed=0, repeat=3, memory=True, data=None):
+
+    '''Generates (or reuses) the synthetic data for the scale and benchmarks the pipeline on it. Returns the results as a dict.'''
+
+    data = data or os.path.join(HERE, 'data', '{}_{}_{}_{}'.format(casualties, year, count_points, seed))
+    if not os.path.isfile(os.path.join(data, loading.CASUALTIES_FILE)):
+        start = time.perf_counter()
+        synthetic.generate(data, casualties, [year], count_points, seed)
+        print('generated {} casualties in {:.1f}s: {}'.format(casualties, time.perf_counter() - start, data))
+
+    commit, dirty = git_commit()
+    results = {'commit': commit, 'dirty': dirty, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(), 'versions': versions(),
+               'scale': {'casualties': casualties, 'year': year, 'count_points': count_points, 'seed': seed}, 'repeat': repeat}
+
+    with tempfile.TemporaryDirectory() as out:
+        runs = [time_run(data, year, out) for _ in range(repeat)]
+        results['rows'] = rows(runs[-1][1])
+        results['stages'] = {name: {'wall': min(times[name]['wall'] for times, _ in runs),
+                                    'cpu': min(times[name]['cpu'] for times, _ in runs),
+                                    'runs': [times[name]['wall'] for times, _ in runs]} for name in STAGES}
+        del runs
+        if memory:
+            for name, mem in memory_run(data, year, out).items():
+                results['stages'][name].update(mem)
+
+    results['total'] = sum(stage['wall'] for stage in results['stages'].values())
+
+    return results
+
+
+def report(results, baseline=None):
+
+    '''Prints a table of the stage times (and memory), with the ratio to the baseline results when given.'''
+
+    print('{} casualties, commit {}{}'.format(results['scale']['casualties'], (results['commit'] or 'unknown')[:10], ' (dirty)' if results['dirty'] else ''))
+    print('{:<12}{:>10}{:>10}{:>10}'.format('stage', 'wall s', 'cpu s', 'peak MB') + ('{:>10}{:>8}'.format('base s', 'ratio') if baseline else ''))
+    for name in STAGES + ['total']:
+        stage = results['stages'].get(name, {'wall': results['total'], 'cpu': float('nan')})
+        line = '{:<12}{:>10.3f}{:>10.3f}{:>10.1f}'.format(name, stage['wall'], stage['cpu'], stage.get('peak_mb', float('nan')))
+        if baseline:
+            base = baseline['total'] if name == 'total' else baseline['stages'].get(name, {}).get('wall', float('nan'))
+            line += '{:>10.3f}{:>8.2f}'.format(base, stage['wall'] / base if base else float('nan'))
+        print(line)
+
+
+def main(argv=None):
+
+    '''Command line entry point.'''
+
+    parser = argparse.ArgumentParser(description='Benchmarks each stage of the pipeline on synthetic data.')
+    parser.add_argument('-c', '--casualties', type=int, nargs='+', default=[100000], help='scale(s): casualties per year (default: %(default)s)')
+    parser.add_argument('-y', '--year', type=int, default=2015, help='year of the synthetic data (default: %(default)s)')
+    parser.add_argument('--count-points', type=int, default=22000, help='number of count points (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic data (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='timed runs of each scale, the fastest is reported (default: %(default)s)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('-d', '--data', help='use this data directory rather than generating one')
+    parser.add_argument('-o', '--out', default=os.path.join(HERE, 'results'), help='directory the JSON results are saved to (default: %(default)s)')
+    parser.add_argument('--compare', metavar='JSON', help='earlier results to compare against')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    os.makedirs(args.out, exist_ok=True)
+    for casualties in args.casualties:
+        results = benchmark(casualties, args.year, args.count_points, args.seed, args.repeat, not args.no_memory, args.data)
+        file = os.path.join(args.out, '{}_{}_{}.json'.format(datetime.datetime.now().strftime('%Y%m%d-%H%M%S'), (results['commit'] or 'unknown')[:10], casualties))
+        with open(file, 'w') as f:
+            json.dump(results, f, indent=2)
+        report(results, baseline if baseline and baseline['scale']['casualties'] == casualties else None)
+        print('results saved to {}'.format(file))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
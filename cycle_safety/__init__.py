@@ -0,0 +1,49 @@
+'''Cycle Safety: matching the DfT road casualty data (STATS19) with the traffic count data (AADF) to estimate the traffic flows
+at each casualty location.
+
+The stage functions (see cycle_safety.pipeline) are available from the package but are only imported, along with numpy / pandas,
+the first time they're used.'''
+
+import importlib
+
+
+__version__ = '0.1.0'
+
+_STAGES = {
+    'load_counts': 'loading',
+    'load_casualties': 'loading',
+    'Stats19': 'loading',
+    'stream_casualties': 'loading',
+    'prepare_counts': 'counts',
+    'CountIndex': 'counts',
+    'CountYears': 'counts',
+    'decode_casualties': 'decoding',
+    'knn_match': 'matching',
+    'LinkIndex': 'links',
+    'interpolate_counts': 'interpolation',
+    'merge_casualties': 'export',
+    'export_casualties': 'export',
+    'export_partitions': 'export',
+    'PartitionWriter': 'export',
+    'run': 'pipeline',
+    'run_years': 'pipeline',
+    'stream_year': 'pipeline',
+    'Instrument': 'instrument',
+    'Cache': 'cache',
+    'Region': 'region',
+    'LookupGrid': 'grid',
+    'Cube': 'cube',
+    'TrafficService': 'service',
+}
+
+__all__ = list(_STAGES)
+
+
+def __getattr__(name):
+
+    '''Imports the stage functions lazily.'''
+
+    if name in _STAGES:
+        return getattr(importlib.import_module('.' + _STAGES[name], __name__), name)
+
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -0,0 +1,9 @@
+'''Allows the pipeline to be run with ``python -m cycle_safety``.'''
+
+import sys
+
+from .cli import main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
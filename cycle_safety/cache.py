@@ -0,0 +1,174 @@
+'''Cache of the intermediate frames (cleaned Traffic Counts, decoded Casualties and the Knn match table) stored as Parquet files, so a re-run
+on unchanged inputs (e.g. with a different Police Force filter) skips straight to the interpolation and final join.
+
+Each entry is keyed by a hash of:
+* the source zip files it was built from (their contents, the hash is remembered against the file's size & modified time)
+* the parameters it was built with (year, k, ...)
+* the source code of the modules which build it
+so changing any of them simply misses the cache. The cache is kept under max_size by removing the least recently used entries.
+
+Parquet needs pyarrow (pip install cycle-safety[cache]).'''
+
+import hashlib
+import importlib.util
+import json
+import os
+import tempfile
+
+import pandas as pd
+
+from .instrument import call
+
+
+MAX_SIZE = 2 * 2 ** 30                                                       # Bytes the cache is allowed to grow to
+HASH_BLOCK = 2 ** 20                                                         # Bytes read at a time when hashing a source file
+
+# Modules whose code each frame depends on
+
+CODE_MODULES = {
+    'counts': ['loading', 'projection', 'counts', 'region'],
+    'casualties': ['loading', 'decoding', 'region'],
+    'knn': ['loading', 'projection', 'counts', 'decoding', 'matching', 'grid', 'parallel', 'links', 'region'],
+}
+
+
+def code_hash(modules):
+
+    '''Hash of the source code of the given cycle_safety modules.'''
+
+    sha = hashlib.sha256()
+    for module in modules:
+        with open(importlib.util.find_spec('.' + module, __package__).origin, 'rb') as f:
+            sha.update(f.read())
+
+    return sha.hexdigest()
+
+
+def cached(cache, name, sources, params, build, stage=call):
+
+    '''The frame from the cache when there is one (see Cache.frame), otherwise just build().'''
+
+    if cache is None:
+        return build()
+
+    return cache.frame(name, sources, params, build, stage)
+
+
+class Cache(object):
+
+    '''A directory of cached frames, each a Parquet file named {name}-{key}.parquet. sources.json remembers the hash of each source file.'''
+
+    def __init__(self, directory, max_size=MAX_SIZE):
+
+        self.directory = directory
+        self.max_size = max_size
+        self.code = {name: code_hash(modules) for name, modules in CODE_MODULES.items()}
+        self.hashes = {}
+
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(os.path.join(directory, 'sources.json')) as f:
+                self.hashes = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        self.evict()                                                         # In case max_size is smaller than last time
+
+    def source_hash(self, file):
+
+        '''Hash of a source file's contents, only re-read when its size or modified time changes.'''
+
+        stat = os.stat(file)
+        path = os.path.realpath(file)
+        known = self.hashes.get(path)
+        if known and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime_ns:
+            return known['sha256']
+
+        sha = hashlib.sha256()
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b''):
+                sha.update(block)
+        self.hashes[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': sha.hexdigest()}
+        self._write_json('sources.json', self.hashes)
+
+        return sha.hexdigest()
+
+    def file(self, name, sources, params):
+
+        '''Path of the entry for the frame called name built from the sources with the params.'''
+
+        key = json.dumps({'sources': [self.source_hash(file) for file in sources], 'params': params, 'code': self.code[name]}, sort_keys=True)
+
+        return os.path.join(self.directory, '{}-{}.parquet'.format(name, hashlib.sha256(key.encode()).hexdigest()[:24]))
+
+    def has(self, name, sources, params):
+
+        '''Whether the frame is in the cache.'''
+
+        return os.path.isfile(self.file(name, sources, params))
+
+    def frame(self, name, sources, params, build, stage=call):
+
+        '''Returns the frame called name built from the sources with the params: read from the cache ('cached_{name}' stage) when it's there,
+        otherwise built with build() and added to the cache.'''
+
+        file = self.file(name, sources, params)
+        if os.path.isfile(file):
+            try:
+                df = stage('cached_' + name, pd.read_parquet, file)
+                os.utime(file)                                               # Marks the entry as recently used
+                return df
+            except FileNotFoundError:                                        # Evicted by another process in the meantime
+                pass
+
+        df = build()
+        self.put(file, df)
+
+        return df
+
+    def put(self, file, df):
+
+        '''Writes a frame to the cache (via a temporary file so readers never see half an entry), then evicts down to max_size.'''
+
+        handle, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(handle)
+        try:
+            df.to_parquet(temp)
+            os.replace(temp, file)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+        self.evict()
+
+    def evict(self):
+
+        '''Removes the least recently used entries until the cache fits in max_size.'''
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.parquet'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:                                    # Removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _write_json(self, name, data):
+
+        '''Writes a JSON file in the cache directory atomically.'''
+
+        handle, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp, os.path.join(self.directory, name))
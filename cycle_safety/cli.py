@@ -0,0 +1,231 @@
+'''Command line interface, e.g. ``cycle-safety --year 2015 --data data/ --out out/``.
+
+Only the standard library is imported up front so --help and --dry-run start quickly; the pipeline (and with it numpy, pandas,
+scipy and pyproj) is imported once there's work to do.'''
+
+import argparse
+import logging
+import os
+import sys
+
+
+def parse_args(argv=None):
+
+    '''Parses the command line arguments.'''
+
+    parser = argparse.ArgumentParser(prog='cycle-safety',
+                                     description='Matches the road casualty data (STATS19) with the traffic count data (AADF) and '
+                                                 'estimates the traffic flows at each casualty location.')
+
+    parser.add_argument('-y', '--year', type=int, nargs='+', default=[2015], help='year(s) to process (default: %(default)s)')
+    parser.add_argument('-d', '--data', default='data/', help='directory holding the downloaded DfT zip files (default: %(default)s)')
+    parser.add_argument('-o', '--out', default='out/', help='directory the output files are written to (default: %(default)s)')
+    parser.add_argument('-p', '--police-force', action='append', metavar='FORCE',
+                        help='police force name or code to output, may be repeated (default: Metropolitan Police and City of London)')
+    parser.add_argument('--all-forces', action='store_true', help='output the casualties of every police force')
+    parser.add_argument('-k', type=int, help='number of count points each casualty is matched with (default: 2)')
+    parser.add_argument('--weighting', choices=['relative','idw','nearest'], help='how the count points are weighted (default: relative)')
+    parser.add_argument('--idw-power', type=float, help="power of the distance used by the 'idw' weighting (default: 2)")
+    parser.add_argument('--lonlat', action='store_true', help='match in Lon / Lat degrees rather than BNG metres')
+    parser.add_argument('--max-distance', type=float, metavar='METRES',
+                        help='furthest a count point may be from a casualty (degrees with --lonlat); casualties with none that close on their road '
+                             'are matched on their road type and failing that not at all (default: no limit)')
+    parser.add_argument('--links', action='store_true',
+                        help='snap casualties on named roads to the road link (between junctions) of a count point and take its count alone')
+    parser.add_argument('--fill-years', type=int, metavar='N',
+                        help='fill in the count points not surveyed in a year from the nearest year (up to N years away) they were')
+    parser.add_argument('--growth', nargs='+', metavar='RATE',
+                        help='annual traffic growth applied to counts filled in from other years, one rate for every road type or CLASS=RATE '
+                             'for each road type, e.g. A=0.01 U=0.005 (default: none)')
+    parser.add_argument('-j', '--processes', type=int, help='processes to run several years in (default: one per year up to the number of CPUs)')
+    parser.add_argument('--match-processes', type=int, metavar='N',
+                        help='processes the road groups of each year are matched in (default: matched in the year\'s process)')
+    parser.add_argument('--grid', metavar='DIR',
+                        help='match through a precomputed lookup grid of the count points kept in DIR/YEAR (built there on first use)')
+    parser.add_argument('--combine', action='store_true', help='write several years to one output file rather than one file per year')
+    parser.add_argument('--partition', choices=['csv.gz','parquet'],
+                        help='write a file per police force and year (out/year=2015/police_force=1/casualties.csv.gz, ...) plus out/manifest.json')
+    parser.add_argument('--threads', type=int, help='threads writing the partitions (default: chosen by Python)')
+    parser.add_argument('--stream', action='store_true',
+                        help='stream the casualties through a block of accidents at a time, appending them to the partitions (implies --partition csv.gz '
+                             'unless given), so memory is set by --chunk-size rather than the number of casualties')
+    parser.add_argument('--chunk-size', type=int, default=50000, metavar='ROWS', help='accidents per block with --stream (default: %(default)s)')
+    parser.add_argument('--cube', metavar='FILE', help='save the exposure-risk cube of every casualty to FILE (.npz, numbered by year for several years)')
+    parser.add_argument('--region-force', action='append', metavar='FORCE',
+                        help='only process casualties of this police force (name or code), may be repeated')
+    parser.add_argument('--region-authority', action='append', metavar='LA',
+                        help='only process casualties in this local authority (district or highway code), may be repeated')
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('WEST','SOUTH','EAST','NORTH'), help='only process casualties in this lon / lat box')
+    parser.add_argument('--bbox-bng', type=float, nargs=4, metavar=('WEST','SOUTH','EAST','NORTH'), help='only process casualties in this BNG box')
+    parser.add_argument('--buffer', type=float, help='metres around the region within which count points are kept (default: 10000)')
+    parser.add_argument('--cache', metavar='DIR', help='keep the cleaned traffic counts, decoded casualties and matches in DIR to speed up re-runs')
+    parser.add_argument('--cache-size', type=float, default=2, metavar='GB', help='size the cache is kept under (default: %(default)s GB)')
+    parser.add_argument('--report', metavar='FILE', help='measure each stage (time, rows, memory) and save the measurements as JSON')
+    parser.add_argument('--profile', metavar='DIR', help='write a cProfile dump of each stage to DIR')
+    parser.add_argument('--memory', choices=['rss','tracemalloc','none'], default='rss',
+                        help="how the memory of each stage is measured with --report / --profile (default: %(default)s)")
+    parser.add_argument('-n', '--dry-run', action='store_true', help='check the inputs and show what would be run without loading any data')
+
+    args = parser.parse_args(argv)
+
+    if args.stream and (args.cube or args.combine):
+        parser.error('--stream writes partitions a block at a time so can\'t be used with --cube or --combine')
+    if args.grid and args.lonlat:
+        parser.error('--grid is a BNG raster so can\'t be used with --lonlat')
+    if args.links and args.lonlat:
+        parser.error('--links snaps to road links in BNG so can\'t be used with --lonlat')
+    if args.growth and not args.fill_years:
+        parser.error('--growth only applies to counts filled in from other years with --fill-years')
+    if args.growth:
+        try:
+            args.growth = growth_rates(args.growth)
+        except ValueError:
+            parser.error('--growth takes one RATE or CLASS=RATE for each road type, e.g. --growth A=0.01 U=0.005')
+    if args.stream and not args.partition:
+        args.partition = 'csv.gz'
+
+    return args
+
+
+def growth_rates(values):
+
+    '''The growth given on the command line: one annual rate for every road type (e.g. 0.01), or a dictionary of rates (e.g. A=0.01 U=0.005).'''
+
+    if len(values) == 1 and '=' not in values[0]:
+        return float(values[0])
+
+    rates = {}
+    for value in values:
+        road_type, rate = value.split('=')                                   # A ValueError unless exactly one '='
+        rates[road_type.strip().upper()] = float(rate)
+
+    return rates
+
+
+def run_options(args):
+
+    '''Turns the parsed arguments into keyword arguments for pipeline.run (options not given are left to its defaults).
+    The region is left as the keyword arguments of a Region.'''
+
+    options = {'path': args.data, 'out': args.out}
+
+    if args.all_forces:
+        options['police_forces'] = None
+    elif args.police_force:
+        options['police_forces'] = args.police_force
+    if args.lonlat:
+        options['match_bng'] = False
+    if args.k is not None:
+        options['k'] = args.k
+    if args.weighting is not None:
+        options['weighting'] = args.weighting
+    if args.idw_power is not None:
+        options['idw_power'] = args.idw_power
+    if args.max_distance is not None:
+        options['max_distance'] = args.max_distance
+    if args.links:
+        options['links'] = True
+    if args.fill_years:
+        options['fill_years'] = args.fill_years
+    if args.growth:
+        options['growth'] = args.growth
+    if args.match_processes:
+        options['match_processes'] = args.match_processes
+    if args.grid:
+        options['grid'] = args.grid
+    if args.partition:
+        options['partition'] = args.partition
+    if args.threads is not None:
+        options['threads'] = args.threads
+    if args.cube:
+        options['cube'] = args.cube
+    if args.region_force or args.region_authority or args.bbox or args.bbox_bng:
+        options['region'] = {'police_forces': args.region_force, 'local_authorities': args.region_authority, 'bbox': args.bbox or args.bbox_bng,
+                             'crs': 'bng' if args.bbox_bng else 'lonlat'}        # Made into a Region once the pipeline is imported
+        if args.buffer is not None:
+            options['region']['buffer'] = args.buffer
+
+    return options
+
+
+def output_name(args, year):
+
+    '''Name of the output file for a year (only numbered by year when several years are written separately), or its directory when partitioned.'''
+
+    if args.partition:
+        return 'year={}'.format(year)
+
+    return 'Casualties.csv' if len(args.year) == 1 or args.combine else 'Casualties_{}.csv'.format(year)
+
+
+def instrument(args):
+
+    '''An Instrument for the run when --report or --profile is given (logging a JSON line per stage to stderr), otherwise None.'''
+
+    if not (args.report or args.profile):
+        return None
+
+    from .instrument import Instrument
+
+    return Instrument(None if args.memory == 'none' else args.memory, args.profile, log=True)
+
+
+def dry_run(args):
+
+    '''Shows what would be run and checks the input files exist, without importing the pipeline. Returns the exit code.'''
+
+    inputs = [os.path.join(args.data, file) for file in ['gb-road-traffic-counts.zip','road-accidents-safety-data.zip']]
+    missing = [file for file in inputs if not os.path.isfile(file)]
+
+    for file in inputs:
+        print('input:  {}{}'.format(file, ' (missing)' if file in missing else ''))
+    for year in args.year:
+        print('{}:   {}'.format(year, os.path.join(args.out, output_name(args, year))))
+    print('options: {}'.format(run_options(args)))
+
+    return 1 if missing else 0
+
+
+def main(argv=None):
+
+    '''Entry point of the cycle-safety command.'''
+
+    args = parse_args(argv)
+
+    if args.dry_run:
+        return dry_run(args)
+
+    from . import pipeline                                                   # Heavy imports only once there's work to do
+
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    logging.getLogger('cycle_safety.instrument').setLevel(logging.INFO)
+    logging.getLogger('cycle_safety.pipeline').setLevel(logging.INFO)       # The match counts of each year
+
+    options = run_options(args)
+    measure = instrument(args)
+    if 'region' in options:
+        from .region import Region
+        options['region'] = Region(**options['region'])
+    if args.cache:
+        from .cache import Cache
+        options['cache'] = Cache(args.cache, int(args.cache_size * 2 ** 30))
+
+    if args.stream:
+        counts = {year: pipeline.stream_year(year, instrument=measure, chunk_size=args.chunk_size, **options) for year in args.year}
+    elif len(args.year) == 1:
+        counts = {args.year[0]: len(pipeline.run(args.year[0], instrument=measure, **options))}
+    else:
+        counts = pipeline.run_years(args.year, combine=args.combine, processes=args.processes, instrument=measure, **options)
+
+    for year, count in counts.items():
+        print('{}: {} casualties processed, output written to {}'.format(year, count, os.path.join(args.out, output_name(args, year))))
+
+    if args.report:
+        measure.write(args.report)
+        print('stage measurements written to {}'.format(args.report))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+'''Cleaning the Traffic Count data and indexing the Count Points so Casualties can be matched against them.'''
+
+import numpy as np
+
+from .loading import TC_COUNTS
+from .projection import bng_to_lonlat
+
+
+TYPE_LIST = ['A','B','M','C','U']                                            # List of road types
+UNNAMED = ['C','U']                                                          # Road types whose roads aren't named individually
+GV_COUNTS = ['FdHGV','FdHGVA3','FdHGVA5','FdHGVA6','FdHGVR2','FdHGVR3','FdHGVR4','FdLGV']
+
+
+def prepare_counts(df_tc_raw):
+
+    '''Cleans the raw Traffic Counts: creates a master Goods Vehicle variable, converts the Eastings / Northings to Lon / Lat and
+    creates the 1st Road Class variable. Count Points with no location (recorded at the grid origin) get nan co-ordinates.'''
+
+    df_tc = df_tc_raw.drop(['AADFYear'], axis=1)                             # Unwanted variables are never parsed so only the year needs dropping
+
+    # Creating a master Goods Vehicle Variable
+
+    df_tc['FdAll_GV'] = sum([df_tc[col] for col in GV_COUNTS])
+    df_tc = df_tc.drop(GV_COUNTS, axis=1)
+
+    # Converting the Eastings / Northings columns in one go
+
+    missing = (df_tc['S Ref E'] == 0) & (df_tc['S Ref N'] == 0)              # Count Points with no location are recorded at the grid origin
+    df_tc[['S Ref E','S Ref N']] = df_tc[['S Ref E','S Ref N']].astype(float).mask(missing)   # Masking missing locations as nan
+    df_tc['Lon_S'], df_tc['Lat_S'] = bng_to_lonlat(df_tc['S Ref E'], df_tc['S Ref N'])       # Performing the conversion (nan stays nan)
+
+    df_tc['1st_Road_Class'] = df_tc['Road'].str[0:1]                         # Creating the 1st Road Class variable
+
+    return df_tc
+
+
+class CountYears(object):
+
+    '''The raw Traffic Counts of several years held as one compact (Count Points, years) array of their rows, so that a year's counts can be
+    filled in from the nearest year each Count Point was surveyed in a few vectorised operations, whichever year is asked for:
+    * years - the years held, in order
+    * cps - the Count Points (CP) held, in order
+    * rows - (Count Points, years) df_tc_raw row of each Count Point's counts in each year, -1 where it wasn't surveyed
+    A Count Point with more than one row in a year keeps the first (in the order loaded, e.g. the major roads before the minor roads).'''
+
+    def __init__(self, df_tc_raw):
+
+        self.df_tc_raw = df_tc_raw.reset_index(drop=True)
+        self.years = np.unique(self.df_tc_raw['AADFYear'].values).astype(int)
+        self.cps, cp_pos = np.unique(self.df_tc_raw['CP'].values, return_inverse=True)
+        year_pos = np.searchsorted(self.years, self.df_tc_raw['AADFYear'].values)
+        first = ~self.df_tc_raw.duplicated(['CP','AADFYear']).values          # The first row of each Count Point & year
+
+        self.rows = np.full((len(self.cps), len(self.years)), -1, dtype=np.int64)
+        self.rows[cp_pos[first], year_pos[first]] = np.flatnonzero(first)
+
+    def year(self, year, max_gap=None, growth=None):
+
+        '''The raw Traffic Counts of a year with every Count Point surveyed within max_gap years of it (any year held when not given): its
+        counts from the year itself where it was surveyed then, otherwise from the nearest year it was (the earlier on a tie). The AADFYear
+        of each row is the year its counts come from. With growth (an annual rate, or a dictionary of the rate of each Road Type) counts
+        taken from another year are grown by (1 + rate) ** (year - AADFYear), rounded back to whole counts.'''
+
+        gaps = np.where(self.rows >= 0, np.abs(self.years - year), np.iinfo(np.int64).max)   # (Count Points, years)
+        nearest = gaps.argmin(axis=1)                                        # The first (earlier) year on a tie
+        gap = gaps[np.arange(len(self.cps)), nearest]
+        kept = gap <= (np.iinfo(np.int64).max - 1 if max_gap is None else max_gap)
+
+        df_tc_raw = self.df_tc_raw.iloc[np.sort(self.rows[kept, nearest[kept]])].reset_index(drop=True)   # In the order they were loaded
+
+        if growth:
+            road_types = df_tc_raw['Road'].astype(object).str[0:1]
+            rate = road_types.map(growth).fillna(0).values.astype(float) if isinstance(growth, dict) else np.full(len(df_tc_raw), float(growth))
+            scale = (1 + rate) ** (year - df_tc_raw['AADFYear'].values.astype(int))
+            df_tc_raw[TC_COUNTS] = np.rint(df_tc_raw[TC_COUNTS].values * scale[:, None]).astype(df_tc_raw[TC_COUNTS].dtypes.iloc[0])
+
+        return df_tc_raw
+
+
+class CountIndex(object):
+
+    '''The cleaned Traffic Count data (df_tc) along with everything needed to match Casualties against it:
+    * coords - the co-ordinates of every Count Point used for matching (BNG Eastings / Northings or Lon / Lat), by df_tc row
+    * name_rows - dictionary of the df_tc rows of the Count Points on each road name (e.g. A315)
+    * type_rows - dictionary of the df_tc rows of the Count Points of each road type (e.g. 'A' Road)
+    * road_set / type_set - the road names / road types Casualties can be matched on
+    * size - the number of Count Points, which is also the row used for 'no Count Point'
+    * trees - the KD Trees of the road name / road type groups, built as they're first needed (see matching.group_tree)'''
+
+    def __init__(self, df_tc, match_bng=True):
+
+        self.df_tc = df_tc
+        self.match_bng = match_bng
+        self.size = len(df_tc)
+        self.coords = df_tc[['S Ref E','S Ref N'] if match_bng else ['Lon_S','Lat_S']].values
+
+        road_list = [road for road in df_tc['Road'].unique().tolist() if road not in UNNAMED]   # List of road names
+
+        name_rows = df_tc.groupby('Road', observed=True).indices
+        type_rows = df_tc.groupby('1st_Road_Class').indices
+        self.name_rows = {road_name: name_rows[road_name] for road_name in road_list}
+        self.type_rows = {road_type: type_rows.get(road_type, np.array([], dtype=int)) for road_type in TYPE_LIST}
+
+        # Creating Sets out of the road and type lists to improve performance
+
+        self.road_set = set(road_list)
+        self.type_set = set(TYPE_LIST)
+        self.trees = {}
+
+    def values(self, cols):
+
+        '''Returns the given traffic count variables as one float array, with an extra row of nan's for 'no Count Point' (row size).'''
+
+        return np.vstack([self.df_tc[cols].values.astype(float), np.full(len(cols), np.nan)])
@@ -0,0 +1,145 @@
+'''An exposure-risk cube: the number of Casualties and the sum of their estimated traffic flows (FdPC, FdAll_MV, ...) for every combination of
+Road Class, Day Type, Light, Weather and Road Surface, held as small dense arrays indexed by the categories' integer codes.
+
+    cube = Cube.build(df_cas_out)
+    cube.save('out/cube.npz')
+    cube = Cube.load('out/cube.npz')
+    cube.slice(light='Daylight', weather=['Raining no high winds','Raining + high winds']).rollup(['road_class'], 'FdPC')
+
+slice() selects categories of any dimensions and rollup() sums over every dimension not asked for, so queries only ever touch the cube
+(a few thousand cells) rather than re-scanning the Casualties.'''
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .interpolation import FD_MEASURES
+
+
+# The dimensions of the cube and the (decoded) Casualty variable of each
+
+DIMENSIONS = {
+    'road_class': '1st_Road_Class',
+    'day_type': 'Day_Type',
+    'light': 'Light_Conditions',
+    'weather': 'Weather_Conditions',
+    'surface': 'Road_Surface_Conditions',
+}
+
+PER = 1e6                                                                    # Rates are Casualties per million of the exposure measure
+
+
+def dimension_column(df_cas_out, column):
+
+    '''The Casualty variable of a dimension (the output has 1st_Road_Class_x after the join on to the matched Count Points).'''
+
+    return df_cas_out[column] if column in df_cas_out else df_cas_out[column + '_x']
+
+
+class Cube(object):
+
+    '''The cube itself:
+    * dims - the dimension names, in axis order
+    * categories - the categories of each dimension, in code order
+    * casualties - the number of Casualties in each cell
+    * matched - the number of those with traffic estimates (i.e. matched with Count Points)
+    * sums - the summed traffic estimate of each measure in each cell'''
+
+    def __init__(self, dims, categories, casualties, matched, sums):
+
+        self.dims = list(dims)
+        self.categories = {dim: list(categories[dim]) for dim in self.dims}
+        self.casualties = casualties
+        self.matched = matched
+        self.sums = sums
+
+    @classmethod
+    def build(cls, df_cas_out, dimensions=DIMENSIONS, measures=FD_MEASURES):
+
+        '''Aggregates the output Casualties into a cube in one pass: each Casualty's cell is found from its categories' codes and the
+        counts and sums are totalled with bincount. Casualties missing a category are left out.'''
+
+        columns = {dim: pd.Categorical(dimension_column(df_cas_out, column)) for dim, column in dimensions.items()}
+        categories = {dim: col.categories.tolist() for dim, col in columns.items()}
+        shape = tuple(len(categories[dim]) for dim in dimensions)
+
+        codes = np.array([col.codes for col in columns.values()]).reshape(len(shape), -1)
+        valid = (codes >= 0).all(axis=0)
+        cells = np.ravel_multi_index(codes[:, valid], shape) if shape else np.zeros(valid.sum(), dtype=int)
+        size = int(np.prod(shape))
+
+        def total(weights=None):
+            return np.bincount(cells, weights, minlength=size).reshape(shape)
+
+        values = {measure: df_cas_out[measure].to_numpy(dtype=float)[valid] for measure in measures}
+        matched = total(np.isfinite(values[measures[0]])).astype(np.int64) if measures else total()
+        sums = {measure: total(np.nan_to_num(value)) for measure, value in values.items()}
+
+        return cls(dimensions, categories, total().astype(np.int64), matched, sums)
+
+    def save(self, file):
+
+        '''Saves the cube as a compressed .npz file (the categories are stored as JSON), making its directory if need be. Returns the file.'''
+
+        os.makedirs(os.path.dirname(file) or '.', exist_ok=True)
+        np.savez_compressed(file, meta=np.array(json.dumps({'dims': self.dims, 'categories': self.categories, 'measures': list(self.sums)})),
+                            casualties=self.casualties, matched=self.matched, **{'sum_' + measure: value for measure, value in self.sums.items()})
+
+        return file
+
+    @classmethod
+    def load(cls, file):
+
+        '''Loads a cube saved with save().'''
+
+        with np.load(file) as data:
+            meta = json.loads(str(data['meta']))
+            return cls(meta['dims'], meta['categories'], data['casualties'], data['matched'],
+                       {measure: data['sum_' + measure] for measure in meta['measures']})
+
+    def slice(self, **selection):
+
+        '''A cube of the selected categories only, e.g. slice(light='Daylight', road_class=['A','B']).'''
+
+        casualties, matched, sums, categories = self.casualties, self.matched, dict(self.sums), dict(self.categories)
+
+        for dim, values in selection.items():
+            if dim not in self.dims:
+                raise ValueError('Unknown dimension: {}'.format(dim))
+            values = [values] if isinstance(values, str) or not np.iterable(values) else list(values)
+            positions = [categories[dim].index(value) for value in values if value in categories[dim]]
+            axis = self.dims.index(dim)
+            casualties, matched = casualties.take(positions, axis=axis), matched.take(positions, axis=axis)
+            sums = {measure: value.take(positions, axis=axis) for measure, value in sums.items()}
+            categories[dim] = [categories[dim][p] for p in positions]
+
+        return Cube(self.dims, categories, casualties, matched, sums)
+
+    def rollup(self, by=(), measures=None):
+
+        '''Sums the cube over every dimension not in by and returns a dataframe (one row per combination of the by categories) of the
+        Casualties, the matched Casualties, the summed measures and the rate of each (Casualties per million of the measure).'''
+
+        by = [by] if isinstance(by, str) else list(by)
+        measures = list(self.sums) if measures is None else [measures] if isinstance(measures, str) else list(measures)
+        other = tuple(axis for axis, dim in enumerate(self.dims) if dim not in by)
+        order = [self.dims.index(dim) for dim in by]                          # The by dimensions in the order asked for
+
+        def total(value):
+            summed = value.sum(axis=other)
+            return np.transpose(summed, np.argsort(np.argsort(order))).ravel() if order else np.atleast_1d(summed)
+
+        if by:
+            index = pd.MultiIndex.from_product([self.categories[dim] for dim in by], names=by)
+        else:
+            index = pd.Index(['All'])
+        df = pd.DataFrame({'Casualties': total(self.casualties), 'Matched': total(self.matched)}, index=index)
+        for measure in measures:
+            df[measure] = total(self.sums[measure])
+        for measure in measures:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                df['Rate_' + measure] = np.where(df[measure] > 0, df['Matched'] / df[measure] * PER, np.nan)
+
+        return df
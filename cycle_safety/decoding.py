@@ -0,0 +1,112 @@
+'''Decoding the STATS19 code columns into meaningful values using lookup tables.
+
+The decodes come from the Road Safety Data Guide: http://data.dft.gov.uk/road-accidents-safety-data/Road-Accident-Safety-Data-Guide.xls'''
+
+import pandas as pd
+
+
+DECODE_TABLES = {
+    'Police_Force': {
+        1: 'Metropolitan Police', 3: 'Cumbria', 4: 'Lancashire', 5: 'Merseyside', 6: 'Greater Manchester', 7: 'Cheshire', 10: 'Northumbria',
+        11: 'Durham', 12: 'North Yorkshire', 13: 'West Yorkshire', 14: 'South Yorkshire', 16: 'Humberside', 17: 'Cleveland', 20: 'West Midlands',
+        21: 'Staffordshire', 22: 'West Mercia', 23: 'Warwickshire', 30: 'Derbyshire', 31: 'Nottinghamshire', 32: 'Lincolnshire',
+        33: 'Leicestershire', 34: 'Northamptonshire', 35: 'Cambridgeshire', 36: 'Norfolk', 37: 'Suffolk', 40: 'Bedfordshire', 41: 'Hertfordshire',
+        42: 'Essex', 43: 'Thames Valley', 44: 'Hampshire', 45: 'Surrey', 46: 'Kent', 47: 'Sussex', 48: 'City of London', 50: 'Devon and Cornwall',
+        52: 'Avon and Somerset', 53: 'Gloucestershire', 54: 'Wiltshire', 55: 'Dorset', 60: 'North Wales', 61: 'Gwent', 62: 'South Wales',
+        63: 'Dyfed-Powys', 91: 'Northern', 92: 'Grampian', 93: 'Tayside', 94: 'Fife', 95: 'Lothian and Borders', 96: 'Central', 97: 'Strathclyde',
+        98: 'Dumfries and Galloway'},
+    'Casualty_Class': {1: 'Driver or rider', 2: 'Passenger', 3: 'Pedestrian'},
+    'Sex_of_Casualty': {1: 'Male', 2: 'Female'},
+    'Casualty_Severity': {1: 'Fatal', 2: 'Serious', 3: 'Slight'},
+    'Casualty_Type': {
+        0: 'Pedestrian', 1: 'Cyclist', 2: 'Motorcycle 50cc and under rider or passenger', 3: 'Motorcycle 125cc and under rider or passenger',
+        4: 'Motorcycle over 125cc and up to 500cc rider or  passenger', 5: 'Motorcycle over 500cc rider or passenger',
+        8: 'Taxi/Private hire car occupant', 9: 'Car occupant', 10: 'Minibus (8 - 16 passenger seats) occupant',
+        11: 'Bus or coach occupant (17 or more pass seats)', 16: 'Horse rider', 17: 'Agricultural vehicle occupant', 18: 'Tram occupant',
+        19: 'Van / Goods vehicle (3.5 tonnes mgw or under) occupant', 20: 'Goods vehicle (over 3.5t. and under 7.5t.) occupant',
+        21: 'Goods vehicle (7.5 tonnes mgw and over) occupant', 22: 'Mobility scooter rider', 23: 'Electric motorcycle rider or passenger',
+        90: 'Other vehicle occupant', 97: 'Motorcycle - unknown cc rider or passenger', 98: 'Goods vehicle (unknown weight) occupant'},
+    'Junction_Detail': {
+        0: 'Not at junction or within 20 metres', 1: 'Roundabout', 2: 'Mini-roundabout', 3: 'T or staggered junction', 5: 'Slip road',
+        6: 'Crossroads', 7: 'More than 4 arms (not roundabout)', 8: 'Private drive or entrance', 9: 'Other junction'},
+    'Junction_Control': {
+        0: 'Not at junction or within 20 metres', 1: 'Authorised person', 2: 'Auto traffic signal', 3: 'Stop sign', 4: 'Give way or uncontrolled'},
+    'Day_of_Week': {1: 'Sunday', 2: 'Monday', 3: 'Tuesday', 4: 'Wednesday', 5: 'Thursday', 6: 'Friday', 7: 'Saturday'},
+    '1st_Road_Class': {1: 'Motorway', 2: 'A', 3: 'A', 4: 'B', 5: 'C'},
+    'Road_Type': {1: 'Roundabout', 2: 'One way street', 3: 'Dual carriageway', 6: 'Single carriageway', 7: 'Slip road', 9: 'Unknown',
+                  12: 'One way street/Slip road'},
+    'Light_Conditions': {1: 'Daylight', 4: 'Darkness - lights lit', 5: 'Darkness - lights unlit', 6: 'no lighting', 7: 'lighting unknown'},
+    'Weather_Conditions': {
+        1: 'Fine no high winds', 2: 'Raining no high winds', 3: 'Snowing no high winds', 4: 'Fine + high winds', 5: 'Raining + high winds',
+        6: 'Snowing + high winds', 7: 'Fog or mist', 8: 'Other'},
+    'Road_Surface_Conditions': {1: 'Dry', 2: 'Wet or damp', 3: 'Snow', 4: 'Frost or ice', 5: 'Flood over 3cm. deep', 6: 'Oil or diesel', 7: 'Mud'},
+    'Urban_or_Rural_Area': {1: 'Urban', 2: 'Rural'},
+}
+
+DECODE_DEFAULTS = {'1st_Road_Class': 'U'}                                    # Value given to codes missing from a table ('Unknown' otherwise)
+ROAD_CLASSES = {value[:1].upper(): value for value in list(DECODE_TABLES['1st_Road_Class'].values()) + [DECODE_DEFAULTS['1st_Road_Class']]}
+
+# Derived columns are decoded straight from the codes of their source column
+
+JUNCTIONS = ['T or staggered junction','Crossroads','Roundabout','Mini-roundabout','Slip road','Junction - more than 4 arms (not roundabout)','Other junction']
+
+DERIVED_TABLES = {
+    'Junction': ('Junction_Detail', {code: 'Junction' for code, value in DECODE_TABLES['Junction_Detail'].items() if value in JUNCTIONS}, 'Not a Junction'),
+    'Day_Type': ('Day_of_Week', {1: 'Weekend', 2: 'Weekday', 3: 'Weekday', 4: 'Weekday', 5: 'Weekday', 6: 'Weekday', 7: 'Weekend'}, 'Unknown'),
+}
+
+
+def decode(codes, table, default='Unknown'):
+
+    '''Decodes a column of codes into a Categorical of values in a single vectorised step using a lookup table.
+    Codes which are missing from the table (or missing altogether) are decoded as the default value.'''
+
+    categories = list(dict.fromkeys(list(table.values()) + [default]))      # Unique decoded values, in table order
+    positions = {code: categories.index(value) for code, value in table.items()}
+    cat_codes = codes.map(positions).fillna(categories.index(default)).astype('int16')
+
+    return pd.Series(pd.Categorical.from_codes(cat_codes, categories), index=codes.index)
+
+
+def road_class(road):
+
+    '''The Road Class a road given by name or class (e.g. A315, M25, Motorway or U) has once decoded (e.g. 'A', 'Motorway' or 'U'), or None
+    when it isn't one. This is how a road is classed outside the STATS19 tables (see cycle_safety.service).'''
+
+    return ROAD_CLASSES.get(str(road or '').strip().upper()[:1])
+
+
+def road_name(road_class, road_number):
+
+    '''Creates the Road Name (e.g. A315) from the decoded Road Class and the Road Number.
+    Roads which aren't numbered (e.g. 'C' or 'U' roads) are named after their Road Class.'''
+
+    road_class = road_class.astype(str)
+    numbered = road_class.isin(['A','B','M'])
+
+    return road_class.where(~numbered, road_class + road_number.astype(str)).astype('category')
+
+
+def geo(df_cas):
+
+    '''The 'Longitude,Latitude' string of each Casualty. Only rendered for the rows being written out (see export_casualties).'''
+
+    lon, lat = (df_cas[col].to_numpy(dtype=float).astype(str) for col in ['Longitude','Latitude'])   # As str() would, missing values become 'nan'
+
+    return pd.Series(lon, index=df_cas.index) + ',' + lat
+
+
+def decode_casualties(df_cas):
+
+    '''Decodes every code column of the merged Casualties dataframe into Categoricals and creates the more meaningful columns
+    (Junction, Day_Type and Road_Name). The columns are replaced in place and the dataframe is returned.'''
+
+    for column, (source, table, default) in DERIVED_TABLES.items():
+        df_cas[column] = decode(df_cas[source], table, default)             # Derived columns need the codes so are created first
+
+    for column, table in DECODE_TABLES.items():
+        df_cas[column] = decode(df_cas[column], table, DECODE_DEFAULTS.get(column, 'Unknown'))
+
+    df_cas['Road_Name'] = road_name(df_cas['1st_Road_Class'], df_cas['1st_Road_Number'])
+
+    return df_cas
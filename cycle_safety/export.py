@@ -0,0 +1,268 @@
+'''Joining the estimated traffic counts back on to every Casualty and writing the output files.'''
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from .decoding import DECODE_TABLES, geo
+from .interpolation import MATCH_FLAGS
+
+
+POLICE_FORCES = ['Metropolitan Police','City of London']                     # London
+OUTPUT_NAME = 'Casualties.csv'
+GEO_AFTER = 'Urban_or_Rural_Area'                                            # The geo column is written after this one
+
+# Partitioned output: out/year=2015/police_force=1/casualties.csv.gz, ... plus a manifest of every partition
+
+PARTITION_FORMATS = ['csv.gz','parquet']
+PARTITION_FORMAT = 'csv.gz'
+MANIFEST = 'manifest.json'
+GZIP = {'method': 'gzip', 'compresslevel': 1, 'mtime': 0}                   # Fastest level (formatting the csv is the slow part) & no timestamp so
+                                                                             # the same rows always give the same checksum
+
+
+def police_force_names(forces):
+
+    '''Turns any Police Force codes (e.g. 1 or '1') into their decoded names (e.g. 'Metropolitan Police'), leaving names as they are.'''
+
+    return [DECODE_TABLES['Police_Force'].get(int(force), force) if str(force).isdigit() else force for force in forces]
+
+
+def police_force_rows(df_cas_out, police_forces=POLICE_FORCES):
+
+    '''The Casualties of the given Police Forces (names or codes), or every Casualty if police_forces is None.'''
+
+    if police_forces is None:
+        return df_cas_out
+
+    return df_cas_out[(df_cas_out['Police_Force'].isin(police_force_names(police_forces)))]
+
+
+def merge_casualties(df_cas, df_out):
+
+    '''Joins the matched Count Points and estimated traffic counts on to every Casualty (unmatched Casualties get nan's, but a Match_Quality
+    of 0 and no match flag, so they filter like the rest). The join is on Accident_Id, which isn't needed after it so is dropped.'''
+
+    df_cas_out = pd.merge(df_cas, df_out, on='Accident_Id', how='left').drop(columns='Accident_Id')
+    if 'Match_Quality' in df_cas_out:
+        df_cas_out['Match_Quality'] = df_cas_out['Match_Quality'].fillna(0)
+        for flag in MATCH_FLAGS.values():
+            df_cas_out[flag] = df_cas_out[flag].fillna(False).astype(bool)
+
+    return df_cas_out
+
+
+def export_casualties(df_cas_out, out, police_forces=POLICE_FORCES, name=OUTPUT_NAME):
+
+    '''Writes the Casualties of the given Police Forces (names or codes, or every Casualty if police_forces is None) to a csv file in the out directory.
+    Returns the path of the file written.'''
+
+    df_cas_out = with_geo(police_force_rows(df_cas_out, police_forces))
+
+    os.makedirs(out, exist_ok=True)
+    file = os.path.join(out, name)
+    df_cas_out.to_csv(file)
+
+    return file
+
+
+def with_geo(df_cas_out):
+
+    '''Adds the geo column to the rows being written (it's only rendered for them).'''
+
+    if 'geo' in df_cas_out:
+        return df_cas_out
+
+    df_cas_out = df_cas_out.copy(deep=False)
+    df_cas_out.insert(df_cas_out.columns.get_loc(GEO_AFTER) + 1, 'geo', geo(df_cas_out))
+
+    return df_cas_out
+
+
+def partition_path(year, force, fmt=PARTITION_FORMAT):
+
+    '''Path (relative to the out directory) of a Police Force's partition of a year, e.g. year=2015/police_force=1/casualties.csv.gz.'''
+
+    codes = {name: code for code, name in DECODE_TABLES['Police_Force'].items()}
+
+    return os.path.join('year={}'.format(year), 'police_force={}'.format(codes.get(force, force)), 'casualties.' + fmt)
+
+
+def clear_partitions(out, year):
+
+    '''Removes the partitions of a year listed in its manifest (i.e. those written last time).'''
+
+    for entry in read_json(os.path.join(out, 'year={}'.format(year), MANIFEST), []):
+        shutil.rmtree(os.path.dirname(os.path.join(out, entry['path'])), ignore_errors=True)
+
+
+def file_entry(file, rows):
+
+    '''The manifest entry of a written partition: its rows, bytes and sha256.'''
+
+    sha = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            sha.update(block)
+
+    return {'rows': rows, 'bytes': os.path.getsize(file), 'sha256': sha.hexdigest()}
+
+
+def write_partition(df, file, fmt=PARTITION_FORMAT):
+
+    '''Writes one partition (without the dataframe index) and returns its manifest entry: the rows, bytes and sha256 of the file.'''
+
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    if fmt == 'parquet':
+        df.to_parquet(file, index=False)
+    else:
+        df.to_csv(file, index=False, compression=GZIP)
+
+    return file_entry(file, len(df))
+
+
+def export_partitions(df_cas_out, out, year, police_forces=POLICE_FORCES, fmt=PARTITION_FORMAT, threads=None):
+
+    '''Writes the Casualties of the given Police Forces (or every Police Force if police_forces is None) as one file per Police Force in
+    out/year={year}/police_force={code}/casualties.{fmt}, compressed csv or Parquet, writing the files in a pool of threads.
+    The year's partitions are listed (with their rows and checksums) in out/year={year}/manifest.json, replacing any written before, and
+    write_manifest() then gathers every year's into out/manifest.json. Returns the year's manifest entries.'''
+
+    if fmt not in PARTITION_FORMATS:
+        raise ValueError('Unknown partition format: {}'.format(fmt))
+
+    df_cas_out = with_geo(police_force_rows(df_cas_out, police_forces))
+    clear_partitions(out, year)                                              # Clearing out the partitions written last time
+
+    def write(item):
+        force, df = item
+        path = partition_path(year, force, fmt)
+        return dict({'year': year, 'police_force': force, 'path': path}, **write_partition(df, os.path.join(out, path), fmt))
+
+    with ThreadPoolExecutor(threads) as pool:
+        entries = list(pool.map(write, df_cas_out.groupby('Police_Force', observed=True, sort=True)))
+
+    write_json(os.path.join(out, 'year={}'.format(year), MANIFEST), entries)
+
+    return entries
+
+
+class PartitionWriter(object):
+
+    '''Writes a year's Casualties to the same partitions as export_partitions, but a chunk of Casualties at a time: each chunk's rows are appended
+    to their Police Force's file (as another gzip member of the csv, or another row group of the Parquet file) so the year is never held in memory
+    as a whole. close() finishes the files and writes the year's manifest.'''
+
+    def __init__(self, out, year, police_forces=POLICE_FORCES, fmt=PARTITION_FORMAT, threads=None):
+
+        if fmt not in PARTITION_FORMATS:
+            raise ValueError('Unknown partition format: {}'.format(fmt))
+
+        self.out = out
+        self.year = year
+        self.police_forces = police_forces
+        self.fmt = fmt
+        self.rows = {}                                                       # Rows written to each Police Force's partition
+        self.writers = {}                                                    # Open Parquet writer of each Police Force
+        self.pool = ThreadPoolExecutor(threads)
+
+        clear_partitions(out, year)
+
+    def write(self, df_cas_out):
+
+        '''Appends a chunk of Casualties to the partitions. Returns the number of rows written.'''
+
+        df_cas_out = with_geo(police_force_rows(df_cas_out, self.police_forces))
+        rows = df_cas_out.groupby('Police_Force', observed=True, sort=True).indices
+
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+
+            # The chunk is converted to Arrow once & then split, keeping missing text as nulls. Text columns a chunk has none of (all nan)
+            # are still written as strings, so every chunk has the first one's schema
+            table = pa.Table.from_pandas(df_cas_out, preserve_index=False)
+            table = table.cast(pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema],
+                                         metadata=table.schema.metadata))
+            parts = [(force, table.take(pos)) for force, pos in rows.items()]
+        else:
+            parts = [(force, df_cas_out.iloc[pos]) for force, pos in rows.items()]
+
+        list(self.pool.map(self.append, parts))
+
+        return len(df_cas_out)
+
+    def append(self, part):
+
+        '''Appends the rows of one Police Force (a dataframe, or an Arrow table for Parquet) to its partition.'''
+
+        force, rows = part
+        file = os.path.join(self.out, partition_path(self.year, force, self.fmt))
+        if force not in self.rows:
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            self.rows[force] = 0
+
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+
+            if force not in self.writers:
+                self.writers[force] = pq.ParquetWriter(file, rows.schema)
+            self.writers[force].write_table(rows.cast(self.writers[force].schema))
+        else:
+            with open(file, 'ab' if self.rows[force] else 'wb') as f:
+                rows.to_csv(f, header=not self.rows[force], index=False, compression=GZIP)
+
+        self.rows[force] += len(rows)
+
+    def close(self):
+
+        '''Finishes the partitions and writes the year's manifest (Police Forces in code order, as export_partitions lists them).
+        Returns the year's manifest entries.'''
+
+        self.pool.shutdown()
+        for writer in self.writers.values():
+            writer.close()
+
+        order = list(DECODE_TABLES['Police_Force'].values())
+        forces = sorted(self.rows, key=lambda force: order.index(force) if force in order else len(order))
+        entries = [dict({'year': self.year, 'police_force': force, 'path': partition_path(self.year, force, self.fmt)},
+                        **file_entry(os.path.join(self.out, partition_path(self.year, force, self.fmt)), self.rows[force])) for force in forces]
+        write_json(os.path.join(self.out, 'year={}'.format(self.year), MANIFEST), entries)
+
+        return entries
+
+
+def write_manifest(out):
+
+    '''Gathers the manifests of every year in out into out/manifest.json. Returns its path.'''
+
+    partitions = [entry for file in sorted(glob.glob(os.path.join(out, 'year=*', MANIFEST))) for entry in read_json(file, [])]
+
+    return write_json(os.path.join(out, MANIFEST), {'rows': sum(entry['rows'] for entry in partitions), 'partitions': partitions})
+
+
+def read_json(file, default=None):
+
+    '''Reads a JSON file, or returns default if there isn't one.'''
+
+    try:
+        with open(file) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def write_json(file, data):
+
+    '''Writes a JSON file (via a temporary file so readers never see half of it). Returns its path.'''
+
+    os.makedirs(os.path.dirname(file) or '.', exist_ok=True)
+    with open(file + '.tmp', 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(file + '.tmp', file)
+
+    return file
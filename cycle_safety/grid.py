@@ -0,0 +1,202 @@
+'''A precomputed lookup grid of the nearest Count Points, so matching a point is mostly an array index rather than a tree search.
+
+    grid = LookupGrid.build(index)                                           # A BNG raster per Road Name & Road Type group
+    grid.save('grids/2015')                                                  # grid.json plus .npy arrays which load() memory-maps
+    grid = LookupGrid.load('grids/2015', index)
+    knn_match(df_cas, index, k, grid=grid)
+
+Each group's raster covers its Count Points plus margin metres, with resolution metre cells (coarser for groups too large for max_cells).
+For the centre of each cell it stores the df_tc rows & distances of its k + extra nearest Count Points (the candidates) and whether the cell
+is 'safe': the next nearest Count Point after the candidates is further than the kth by more than the cell's diagonal, in which case the
+k nearest Count Points of every point in the cell are among the candidates. A point in a safe cell is matched by working out its distances to
+the cell's candidates and taking the k nearest; points in other cells (near the
+boundaries between Count Points) or outside the raster are refined exactly with the group's tree. So the matches are the tree's: the same
+Count Points at the same distances (to within float rounding, about 1e-9 m), except that Count Points at exactly the same distance from a
+point may come back in the other order. The grid is tied to the Count Points (and k) it was built from and load() refuses any other.'''
+
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+from .matching import K_NEAREST, group_tree, knn_query
+
+
+RESOLUTION = 500                                                             # Metres along each side of a cell
+MARGIN = 5000                                                                # Metres around a group's Count Points its raster covers
+MAX_CELLS = 2 ** 20                                                          # Cells a group's raster may have before its cells are made coarser
+EXTRA = 2                                                                    # Count Points stored for each cell beyond the k nearest
+ARRAYS = ['rows', 'dists', 'safe']
+
+
+def fingerprint(index):
+
+    '''Hash of the Count Points' co-ordinates (by df_tc row), which the grid's rows refer to.'''
+
+    sha = hashlib.sha256(np.ascontiguousarray(index.coords, dtype=float).tobytes())
+    sha.update(str((index.size, index.match_bng)).encode())
+
+    return sha.hexdigest()
+
+
+class LookupGrid(object):
+
+    '''The rasters of every group, held as three arrays of all the cells (each group's cells in a row-major block starting at its offset):
+    * rows - (cells, k + extra) df_tc rows of the cell centre's nearest Count Points, the candidates (index.size for 'no Count Point')
+    * dists - (cells, k + extra) their distances from the cell centre (float32, for reference only, points are always measured exactly)
+    * safe - (cells,) whether every point in the cell has the same k nearest Count Points
+    and groups, the raster of each (col, group): its west & south edges, resolution, columns, rows and offset.'''
+
+    def __init__(self, k, groups, rows, dists, safe, fingerprint):
+
+        self.k = k
+        self.groups = groups
+        self.rows = rows
+        self.dists = dists
+        self.safe = safe
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, index, k=K_NEAREST, resolution=RESOLUTION, margin=MARGIN, max_cells=MAX_CELLS, extra=EXTRA):
+
+        '''Builds the grid of every Road Name and Road Type group of an index (which must match in BNG) for matching k Count Points.'''
+
+        if not index.match_bng:
+            raise ValueError('The lookup grid is a BNG raster so needs an index which matches in BNG')
+
+        groups, rows, dists, safe, offset = {}, [], [], [], 0
+        m = k + extra                                                        # Candidates per cell
+
+        for col, group_rows in [('Road_Name', index.name_rows), ('1st_Road_Class', index.type_rows)]:
+            for group in group_rows:
+                tree, lookup = group_tree(index, col, group)
+                if tree is None:
+                    continue
+
+                located = index.coords[lookup[:-1]]
+                west, south = located.min(axis=0) - margin
+                east, north = located.max(axis=0) + margin
+                res = resolution
+                while math.ceil((east - west) / res) * math.ceil((north - south) / res) > max_cells:
+                    res *= 2                                                 # Coarser cells for the largest groups
+                nx, ny = max(1, math.ceil((east - west) / res)), max(1, math.ceil((north - south) / res))
+
+                x, y = np.meshgrid(west + (np.arange(nx) + 0.5) * res, south + (np.arange(ny) + 0.5) * res)   # Cell centres, row-major
+                d, i = tree.query(np.column_stack([x.ravel(), y.ravel()]), k=m + 1)
+                d, i = d.reshape(-1, m + 1), i.reshape(-1, m + 1)
+
+                rows.append(lookup[i[:, :m]].astype(np.int32))
+                dists.append(d[:, :m].astype(np.float32))
+                with np.errstate(invalid='ignore'):
+                    safe.append(np.isinf(d[:, m]) | (d[:, m] - d[:, k - 1] > res * math.sqrt(2)))   # No more points, or a gap wider than the diagonal
+                groups[(col, group)] = (float(west), float(south), float(res), nx, ny, offset)
+                offset += nx * ny
+
+        def joined(parts, shape, dtype):
+            return np.concatenate(parts) if parts else np.empty(shape, dtype=dtype)
+
+        return cls(k, groups, joined(rows, (0, m), np.int32), joined(dists, (0, m), np.float32), joined(safe, (0,), bool), fingerprint(index))
+
+    def save(self, directory):
+
+        '''Saves the grid as grid.json (the groups) and rows.npy, dists.npy & safe.npy. Returns the directory.'''
+
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+
+        meta = {'k': self.k, 'fingerprint': self.fingerprint, 'groups': [[col, group] + list(raster) for (col, group), raster in self.groups.items()]}
+        with open(os.path.join(directory, 'grid.json'), 'w') as f:
+            json.dump(meta, f)
+
+        return directory
+
+    @classmethod
+    def load(cls, directory, index=None):
+
+        '''Loads a grid saved with save(), memory-mapping its arrays. When an index is given the grid must have been built from its Count Points.'''
+
+        with open(os.path.join(directory, 'grid.json')) as f:
+            meta = json.load(f)
+
+        if index is not None and meta['fingerprint'] != fingerprint(index):
+            raise ValueError('The lookup grid in {} was built from other Count Points'.format(directory))
+
+        arrays = [np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in ARRAYS]
+        groups = {(col, group): tuple(raster) for col, group, *raster in meta['groups']}
+
+        return cls(meta['k'], groups, *arrays, meta['fingerprint'])
+
+    def match(self, index, points, groups, k=K_NEAREST, max_distance=None):
+
+        '''Matches the points (BNG) of each (col, group, positions) group with their k nearest Count Points, as match_points does, from the grid
+        in one vectorised pass over every group (only Count Points closer than max_distance when given, as the trees do). Returns the (points, k)
+        distances and df_tc rows (nan for the points it hasn't matched) and the groups' remaining points (those outside the grid or in cells
+        which aren't safe) to be refined with the trees.'''
+
+        dists = np.full((len(points), k), np.nan)
+        indexes = np.full((len(points), k), np.nan)
+        if k != self.k:
+            return dists, indexes, groups
+
+        # Every gridded point with its group's raster
+
+        gridded = [(pos, self.groups[(col, group)]) for col, group, pos in groups if (col, group) in self.groups]
+        pos = np.concatenate([p for p, _ in gridded] + [np.array([], dtype=np.int64)]).astype(np.int64)
+        rasters = np.repeat(np.array([r for _, r in gridded], dtype=float).reshape(-1, 6), [len(p) for p, _ in gridded], axis=0)
+        west, south, res, nx, ny, offset = rasters.T
+
+        with np.errstate(invalid='ignore'):
+            ix, iy = np.floor((points[pos, 0] - west) / res), np.floor((points[pos, 1] - south) / res)
+        inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)              # Points with missing co-ordinates are never inside
+        cells = (offset + iy * nx + ix)[inside].astype(np.int64)
+        safe = np.zeros(len(points), dtype=bool)
+        safe[pos[inside]] = self.safe[cells]
+        cells = cells[self.safe[cells]]
+        pos = pos[inside][safe[pos[inside]]]
+
+        # Safe cells: the exact distances to the cell's candidates, the k nearest first
+
+        rows = np.asarray(self.rows[cells], dtype=np.int64)
+        none = rows >= index.size
+        d = np.sqrt(((points[pos][:, None, :] - index.coords[np.where(none, 0, rows)]) ** 2).sum(axis=2))
+        d[none] = np.inf
+        if max_distance is not None:
+            d[d >= max_distance] = np.inf                                    # As the trees' distance_upper_bound
+            rows[np.isinf(d)] = index.size
+        order = np.argsort(d, axis=1, kind='stable')[:, :k]
+        dists[pos] = np.take_along_axis(d, order, axis=1)
+        indexes[pos] = np.take_along_axis(rows, order, axis=1)
+
+        rest = [(col, group, p[~safe[p]]) for col, group, p in groups]
+
+        return dists, indexes, [(col, group, p) for col, group, p in rest if len(p)]
+
+    def query(self, index, col, group, points, k=K_NEAREST, max_distance=None):
+
+        '''Matches points (BNG) with the k nearest Count Points of a group, as knn_query does: from the grid where it can, the rest with the tree.'''
+
+        dists, indexes, rest = self.match(index, points, [(col, group, np.arange(len(points)))], k, max_distance)
+        for _, _, pos in rest:
+            dists[pos], indexes[pos] = knn_query(index, col, group, points[pos], k, max_distance)
+
+        return dists, indexes
+
+
+def year_grid(directory, index, k=K_NEAREST):
+
+    '''The grid of an index kept in directory: loaded when the one there was built from the same Count Points for the same k, otherwise
+    built (and saved there, replacing it).'''
+
+    try:
+        grid = LookupGrid.load(directory, index)
+        if grid.k == k:
+            return grid
+    except (OSError, ValueError):
+        pass
+
+    LookupGrid.build(index, k).save(directory)
+
+    return LookupGrid.load(directory, index)
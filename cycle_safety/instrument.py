@@ -0,0 +1,156 @@
+'''Per-stage instrumentation of the pipeline: wall & CPU time, rows in & out, peak memory and (optionally) a cProfile dump of each stage.
+
+    instrument = Instrument()
+    df_tc = instrument('load_counts', load_counts, path, [year])
+    ...
+    instrument.report()                                                      # {'stages': [{'stage': 'load_counts', 'wall': ...}, ...], 'total': {...}}
+
+When no Instrument is given the pipeline calls the stages through call(), which just calls them, so the overhead is nil when it's off.
+The stages are called exactly as they would be otherwise so turning it on doesn't change the outputs.'''
+
+import cProfile
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:                                                          # Not available on Windows
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+MEMORY = 'rss'                                                               # How memory is measured: 'rss', 'tracemalloc' or None
+
+
+def call(name, func, *args, **kwargs):
+
+    '''Calls a stage without instrumenting it (the stand in for an Instrument when instrumentation is off).'''
+
+    return func(*args, **kwargs)
+
+
+def rows(value):
+
+    '''Number of rows in a stage's input or output: the length of a dataframe / array, the size of a CountIndex, the rows of the
+    first item of a tuple, otherwise None.'''
+
+    if isinstance(value, tuple):
+        return rows(value[0]) if value else None
+    if hasattr(value, 'shape'):
+        return value.shape[0] if value.shape else None
+    if hasattr(value, 'size') and isinstance(value.size, int):
+        return value.size
+
+    return None
+
+
+def peak_rss():
+
+    '''Peak resident memory of the process so far in MB (None where it can't be measured).'''
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10  # Bytes on macOS, KB on Linux
+
+
+class Instrument(object):
+
+    '''Records each stage called through it. The options are:
+    * memory - 'rss' records how far each stage raised the peak resident memory of the process (cheap, but a stage which stays
+      under an earlier peak shows 0), 'tracemalloc' records the peak memory allocated during each stage (exact, but slows the stages down)
+      and None skips memory altogether
+    * profile_dir - directory to write a cProfile dump of each stage to (01_load_counts.prof, ...), None for no profiling
+    * log - log a JSON line for each stage (to the cycle_safety.instrument logger at INFO level) as it finishes'''
+
+    def __init__(self, memory=MEMORY, profile_dir=None, log=False):
+
+        if memory not in ('rss', 'tracemalloc', None):
+            raise ValueError('Unknown memory measure: {}'.format(memory))
+
+        self.memory = memory
+        self.profile_dir = profile_dir
+        self.log = log
+        self.stages = []
+
+    def __call__(self, name, func, *args, **kwargs):
+
+        '''Calls func(*args, **kwargs) as the stage called name, recording its measurements, and returns its result.'''
+
+        record = {'stage': name, 'rows_in': next((n for n in map(rows, args) if n is not None), None)}
+
+        if self.memory == 'tracemalloc':
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start()
+            start_mem = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):                           # Python 3.9+, before that the peak covers the earlier stages too
+                tracemalloc.reset_peak()
+        elif self.memory == 'rss':
+            start_mem = peak_rss()
+
+        profile = cProfile.Profile() if self.profile_dir else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile:
+            result = profile.runcall(func, *args, **kwargs)
+        else:
+            result = func(*args, **kwargs)
+        record['wall'] = time.perf_counter() - wall
+        record['cpu'] = time.process_time() - cpu
+        record['rows_out'] = rows(result)
+
+        if self.memory == 'tracemalloc':
+            record['peak_mb'] = (tracemalloc.get_traced_memory()[1] - start_mem) / 2 ** 20
+            if not tracing:
+                tracemalloc.stop()
+        elif self.memory == 'rss' and start_mem is not None:
+            record['peak_mb'] = peak_rss() - start_mem
+            record['peak_rss_mb'] = peak_rss()
+
+        if profile:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            record['profile'] = os.path.join(self.profile_dir, '{:02d}_{}.prof'.format(len(self.stages) + 1, name))
+            profile.dump_stats(record['profile'])
+
+        self.stages.append(record)
+        if self.log:
+            logger.info(json.dumps(record))
+
+        return result
+
+    def partition(self, key):
+
+        '''A new Instrument with the same options for one part of a run (e.g. a year run in another process), profiling into its own
+        sub-directory. Its measurements are added back with add().'''
+
+        return Instrument(self.memory, self.profile_dir and os.path.join(self.profile_dir, str(key)), self.log)
+
+    def add(self, other, **labels):
+
+        '''Adds the measurements of another Instrument (e.g. a partition), labelling each one (e.g. year=2015).'''
+
+        self.stages.extend(dict(record, **labels) for record in other.stages)
+
+    def report(self):
+
+        '''The measurements of every stage so far, plus the total wall & CPU time.'''
+
+        return {'stages': [dict(record) for record in self.stages],
+                'total': {'wall': sum(record['wall'] for record in self.stages), 'cpu': sum(record['cpu'] for record in self.stages)}}
+
+    def write(self, file):
+
+        '''Saves the report as JSON. Returns the path of the file written.'''
+
+        os.makedirs(os.path.dirname(file) or '.', exist_ok=True)
+        with open(file, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+        return file
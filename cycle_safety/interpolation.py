@@ -0,0 +1,101 @@
+'''Attaching the traffic counts of the matched Count Points to each Casualty and weighting them into one estimate per measure.'''
+
+import numpy as np
+
+from .matching import K_NEAREST, MATCH_TYPES, numbered
+
+
+TC_COLS = ['CP','Fd2WMV','FdAll_GV','FdAll_MV','FdBUS','FdCar','FdPC','Lat_S','Lon_S']   # Traffic count variables to attach
+FD_MEASURES = ['FdAll_MV','FdPC','FdAll_GV','FdBUS','FdCar','Fd2WMV']        # All Motor Vehicles, Cycles, Goods Vehicles, Buses, Cars & Motorcycles
+
+WEIGHTING = 'relative'                                                       # How the Count Points are weighted: 'relative', 'idw' or 'nearest'
+IDW_POWER = 2                                                                # Power of the distance used by the 'idw' weighting
+
+TIER_QUALITY = {'Road Link': 1.0, 'Road Name': 0.9, 'Road Type': 0.5}        # Match quality of each match type at no distance
+QUALITY_DISTANCE = 1000                                                      # Metres over which the match quality falls by a factor of e
+MATCH_FLAGS = {match: 'Match_' + match.replace(' ', '_') for match in MATCH_TYPES[:-1]}   # A flag column per match type, e.g. Match_Road_Name
+
+
+def gather(df_knn, index, k=K_NEAREST):
+
+    '''Gathers the traffic count data for all k matched Count Points in one go using their df_tc rows.
+    Casualties which couldn't be matched ('None') are dropped. It returns:
+    * df_out - the Knn data with the traffic count variables of each Count Point
+    * tc_values - the same traffic count variables as a (casualties, k, variables) array
+    * found - a (casualties, k) mask of the Count Points which exist'''
+
+    df_out = df_knn[(df_knn['Assign_Type'] != 'None')].copy()
+    cp_rows = df_out[numbered(['CP_Index'], k)].values.astype(int)
+    tc_values = index.values(TC_COLS).take(cp_rows, axis=0)                  # One gather for all the Count Points: (casualties, k, variables)
+
+    for i, col in enumerate(TC_COLS):
+        df_out[numbered([col], k)] = tc_values[:, :, i]
+
+    df_out = df_out[['1st_Road_Class','Road_Name', 'Accident_Id', 'Assign_Type'] + numbered(['CP','CP_Index','Distance','Metres'], k) + numbered(TC_COLS[1:], k)]
+
+    return df_out, tc_values, cp_rows < index.size
+
+
+def interpolate(dists, values, found, scheme=WEIGHTING, power=IDW_POWER):
+
+    '''Weights the k Count Points matched with each Casualty and combines their traffic counts into one estimate per measure.
+    dists and found are (casualties, k) arrays of distances and whether each Count Point exists, values is a (casualties, k, measures) array.
+    The weighting schemes are:
+    * relative - each Count Point is weighted by the total distance less its own distance (for k = 2 the nearer point gets the further distance)
+    * idw - inverse distance weighting, each Count Point is weighted by 1 / distance ** power
+    * nearest - the nearest Count Point only
+    Where fewer than k Count Points exist only those found are weighted (e.g. a single Count Point gets all the weight).
+    It returns the (casualties, k) weights and the (casualties, measures) estimates.'''
+
+    d = np.where(found, dists, 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if scheme == 'relative':
+            w = np.where(found, d.sum(axis=1, keepdims=True) - d, 0)
+        elif scheme == 'idw':
+            exact = found & (d == 0)                                         # Casualties sitting on a Count Point take its count
+            w = np.where(exact.any(axis=1, keepdims=True), exact, np.where(found, 1 / d ** power, 0))
+        elif scheme == 'nearest':
+            w = found & (np.arange(d.shape[1]) == 0)
+        else:
+            raise ValueError('Unknown weighting scheme: {}'.format(scheme))
+
+        w = w.astype(float)
+        total = w.sum(axis=1, keepdims=True)
+        w = np.where(total > 0, w / total, found / found.sum(axis=1, keepdims=True))  # Equal weights when the weights can't split the points
+
+    estimates = np.einsum('nk,nkm->nm', w, np.where(found[:, :, None], values, 0))
+
+    return w, estimates
+
+
+def match_quality(assign_types, metres, weights, found):
+
+    '''The quality of each match, from 1 (on its Count Point's road link) down to 0: the quality of its match type (TIER_QUALITY) falling
+    exponentially with the weighted distance in metres of its Count Points (QUALITY_DISTANCE), for all the matches at once (0 without a
+    Count Point, whatever its match type). assign_types is an array of match types, metres, weights and found are (matches, k) arrays.'''
+
+    tier = np.select([assign_types == match for match in TIER_QUALITY], list(TIER_QUALITY.values()), 0) * found.any(axis=1)
+    distance = np.nan_to_num(np.where(found, weights * metres, 0), nan=0).sum(axis=1)   # Unmatched points have no weights
+
+    return tier * np.exp(-distance / QUALITY_DISTANCE)
+
+
+def interpolate_counts(df_knn, index, k=K_NEAREST, scheme=WEIGHTING, power=IDW_POWER):
+
+    '''Creates the estimated traffic counts for each matched Casualty: gathers the k Count Points' data and adds the weight given to
+    each Count Point (CP_1_%, CP_2_%, ...), the weighted estimate of each measure (FdAll_MV, FdPC, ...), the quality of the match
+    (Match_Quality, see match_quality) and a flag of the match type used (MATCH_FLAGS, e.g. Match_Road_Name).'''
+
+    df_out, tc_values, found = gather(df_knn, index, k)
+    weights, estimates = interpolate(df_out[numbered(['Distance'], k)].values, tc_values[:, :, [TC_COLS.index(m) for m in FD_MEASURES]], found, scheme, power)
+
+    df_out[['CP_' + str(j) + '_%' for j in range(1, k + 1)]] = weights
+    df_out[FD_MEASURES] = estimates
+
+    assign_types = df_out['Assign_Type'].values.astype(object)
+    df_out['Match_Quality'] = match_quality(assign_types, df_out[numbered(['Metres'], k)].values, weights, found)
+    for match, flag in MATCH_FLAGS.items():
+        df_out[flag] = (assign_types == match) & found.any(axis=1)          # Only matches with a Count Point
+
+    return df_out
@@ -0,0 +1,170 @@
+'''Snapping Casualties to the road link of a Count Point rather than matching them with the nearest Count Points.
+
+    links = LinkIndex(index)                                                 # The link segments of every named road
+    dists, rows, linked = links.snap(points, names)                          # The link (df_tc row) each point on a named road is on
+    knn_match(df_cas, index, k, links=links)                                 # 'Road Link' matches, one Count Point each
+
+Each major road Count Point counts the traffic on the link between two junctions (A-Junction and B-Junction, LenNet km long) and sits
+part way along it. The links of a road are rebuilt by chaining its Count Points on the junctions they share: two Count Points of a road with
+the same junction at one end are neighbours, and the junction is put on the line between them, splitting it in proportion to their links'
+lengths. Each Count Point's link is then the segments from it to its junctions, with a stub of half its length (away from its other junction)
+for a junction it shares with no other Count Point. Count Points of a named road with no junctions are single points.
+A point is snapped to the nearest segment of its road, found with one KD Tree of every road's segment mid points (a segment can't be nearer
+than its mid point's distance less half its length, which bounds the search, so segments are cut into PIECE metre pieces). The roads are
+kept apart in the tree by shifting each one SEPARATION metres east of the one before, so every point of a year is snapped in a single
+vectorised query whatever road it's on.'''
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from .projection import lonlat_to_bng
+
+
+CANDIDATES = 4                                                               # Nearest segment mid points first measured for each point
+PIECE = 1000                                                                 # Metres segments are cut into, which keeps the search bound tight
+SEPARATION = 1e7                                                             # Metres each road is shifted east of the last (more than GB is wide)
+
+
+def segment_distance(points, starts, ends):
+
+    '''The distance from each point (n, 2) to each of its segments (n, m, 2 starts & ends), as an (n, m) array.'''
+
+    dx, dy = ends[..., 0] - starts[..., 0], ends[..., 1] - starts[..., 1]
+    px, py = points[:, 0:1] - starts[..., 0], points[:, 1:2] - starts[..., 1]
+    length = dx * dx + dy * dy
+    t = np.clip((px * dx + py * dy) / np.where(length > 0, length, 1), 0, 1)   # Along the segment (0 for a single point)
+    ex, ey = px - t * dx, py - t * dy
+
+    return np.sqrt(ex * ex + ey * ey)
+
+
+def cut(starts, ends, piece=PIECE):
+
+    '''Cuts segments into pieces no longer than piece metres. Returns the pieces' starts & ends and the segment of each.'''
+
+    pieces = np.maximum(1, np.ceil(np.hypot(*(ends - starts).T) / piece)).astype(np.int64)
+    segment = np.repeat(np.arange(len(starts)), pieces)
+    step = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)   # Position of each piece along its segment
+
+    return (starts[segment] + (step / pieces[segment])[:, None] * (ends - starts)[segment],
+            starts[segment] + ((step + 1) / pieces[segment])[:, None] * (ends - starts)[segment], segment)
+
+
+class LinkIndex(object):
+
+    '''The link segments of the Count Points of every named road of an index (which must match in BNG), grouped by road:
+    * starts / ends - (segments, 2) BNG co-ordinates of each segment's ends (cut into pieces of at most PIECE metres)
+    * rows - (segments,) df_tc row of the Count Point each segment belongs to
+    * codes / roads - the code of each segment's road / the code of each road with links
+    * halves - the longest half segment of each road (by code)
+    * tree - the KD Tree of every segment's mid point, shifted east by its road's code * SEPARATION'''
+
+    def __init__(self, index):
+
+        if not index.match_bng:
+            raise ValueError('The road links are in BNG so need an index which matches in BNG')
+
+        df_tc = index.df_tc
+        xy = df_tc[['S Ref E','S Ref N']].values.astype(float)
+        length = df_tc['LenNet'].values.astype(float) * 1000                 # Metres
+        rows = np.flatnonzero(np.isfinite(xy).all(axis=1) & df_tc['Road'].isin(index.road_set).values)
+
+        # Every end of a Count Point's link with its junction, paired with the one other Count Point of the road at the same junction
+
+        ends = pd.DataFrame({'row': np.tile(rows, 2), 'end': np.repeat([0, 1], len(rows)),
+                             'road': np.tile(df_tc['Road'].values[rows].astype(object), 2),
+                             'junction': np.concatenate([df_tc[col].values[rows].astype(object) for col in ['A-Junction','B-Junction']])})
+        ends = ends[ends['junction'].notna() & (ends['junction'].astype(str).str.strip() != '')]
+        ends = ends[ends.groupby(['road','junction'])['row'].transform('nunique') == 2]   # Junctions more Count Points share are ambiguous
+        ends = ends.drop_duplicates(['road','junction','row']).sort_values(['road','junction','row'])
+        first, second = ends.iloc[0::2], ends.iloc[1::2]
+
+        i, j = first['row'].values, second['row'].values
+        li, lj = length[i], length[j]
+        with np.errstate(invalid='ignore'):
+            t = np.where(np.isfinite(li) & np.isfinite(lj) & (li + lj > 0), li / (li + lj), 0.5)   # Halfway without link lengths
+        junctions = xy[i] + t[:, None] * (xy[j] - xy[i])
+
+        # Each Count Point's segments: to each junction it shares, otherwise a stub away from the one it does share, otherwise just the point
+
+        joined = np.full((len(df_tc), 2, 2), np.nan)                         # The junction at each end of each Count Point's link
+        joined[i, first['end'].values] = junctions
+        joined[j, second['end'].values] = junctions
+
+        has = np.isfinite(joined[rows, :, 0])
+        starts, stops, owners = [xy[i], xy[j]], [junctions, junctions], [i, j]
+        for end in [0, 1]:
+            stub = rows[~has[:, end] & has[:, 1 - end]]
+            away = xy[stub] - joined[stub, 1 - end]
+            reach = np.hypot(*away.T)
+            half = np.where(np.isfinite(length[stub]) & (length[stub] > 0), length[stub] / 2, reach)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                step = np.where(reach[:, None] > 0, away / reach[:, None] * half[:, None], 0)
+            starts.append(xy[stub])
+            stops.append(xy[stub] + step)
+            owners.append(stub)
+        single = rows[~has.any(axis=1)]
+        starts.append(xy[single])
+        stops.append(xy[single])
+        owners.append(single)
+
+        self.starts, self.ends, segment = cut(np.concatenate(starts), np.concatenate(stops))
+        self.rows = np.concatenate(owners).astype(np.int64)[segment]
+
+        # One tree of every segment's mid point, each road shifted SEPARATION east of the last so a query only finds its own road's segments
+
+        self.codes, roads = pd.factorize(df_tc['Road'].values[self.rows].astype(object))
+        self.roads = {road: code for code, road in enumerate(roads)}
+        halves = np.hypot(*(self.ends - self.starts).T) / 2
+        self.halves = pd.Series(halves).groupby(self.codes).max().reindex(range(len(roads))).values   # The longest half segment of each road
+        shift = np.column_stack([self.codes * SEPARATION, np.zeros(len(self.rows))])
+        self.tree = cKDTree((self.starts + self.ends) / 2 + shift) if len(self.rows) else None
+
+    def snap_codes(self, points, codes):
+
+        '''Snaps points (BNG) to the nearest segment of their roads (by code) all in one go: the nearest CANDIDATES segment mid points are
+        measured first and the search is widened only for points where a segment further on could still be nearer. Returns the distances and
+        the df_tc rows.'''
+
+        dists = np.full(len(points), np.inf)
+        nearest = np.zeros(len(points), dtype=np.int64)
+        queries = points + np.column_stack([codes * SEPARATION, np.zeros(len(points))])
+        todo = np.lexsort([points[:, 0], codes])                             # Points near each other queried together, which is much quicker
+        m = min(CANDIDATES, len(self.rows))
+
+        while len(todo):
+            d_mid, i = self.tree.query(queries[todo], k=m)
+            d_mid, i = d_mid.reshape(-1, m), i.reshape(-1, m)
+            own = self.codes[i] == codes[todo][:, None]                      # Fewer than m segments on the road finds other roads'
+            d = np.where(own, segment_distance(points[todo], self.starts[i], self.ends[i]), np.inf)
+            best = d.argmin(axis=1)
+            dists[todo] = d[np.arange(len(todo)), best]
+            nearest[todo] = i[np.arange(len(todo)), best]
+            if m == len(self.rows):
+                break
+            todo = todo[d_mid[:, -1] - self.halves[codes[todo]] < dists[todo]]   # Points a segment further on could still be nearer to
+            m = min(m * 4, len(self.rows))
+
+        return dists, self.rows[nearest]
+
+    def snap(self, points, names, max_distance=None):
+
+        '''Snaps points (Lon / Lat) on the given Road Names (Series) to the link of their road they're on.
+        Returns the distances (metres) and df_tc rows of the links (nan where not snapped) and a mask of the points snapped: those with
+        co-ordinates on a road with links (and within max_distance of one when given).'''
+
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        codes = names.map(self.roads).values.astype(float)                    # nan for roads without links
+        dists, rows = np.full(len(points), np.nan), np.full(len(points), np.nan)
+
+        located = np.flatnonzero(np.isfinite(codes) & np.isfinite(points).all(axis=1))
+        bng = np.column_stack(lonlat_to_bng(points[located, 0], points[located, 1]))   # Projecting only the points on roads with links
+        located, bng = located[np.isfinite(bng).all(axis=1)], bng[np.isfinite(bng).all(axis=1)]
+        if len(located):
+            dists[located], rows[located] = self.snap_codes(bng, codes[located].astype(np.int64))
+
+        linked = dists < (np.inf if max_distance is None else max_distance)  # nan isn't
+        dists[~linked], rows[~linked] = np.nan, np.nan
+
+        return dists, rows, linked
@@ -0,0 +1,284 @@
+'''Loading the DfT traffic count (AADF) and road safety (STATS19) data straight from the downloaded zip files.
+
+The data sources are:
+
+* AADF Data: https://data.gov.uk/dataset/gb-road-traffic-counts/datapackage.zip
+* Casualty Data: https://data.gov.uk/dataset/road-accidents-safety-data/datapackage.zip
+
+Both are zip files of zip files, each inner zip holding a single csv file.'''
+
+import contextlib
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+
+COUNTS_FILE = 'gb-road-traffic-counts.zip'
+CASUALTIES_FILE = 'road-accidents-safety-data.zip'
+
+SPOOL_SIZE = 256 * 1024 ** 2                                                 # Inner zips larger than this (bytes) are buffered on disk rather than in memory
+CHUNK_SIZE = 100000                                                          # Rows parsed at a time when filtering the traffic counts by year
+STREAM_SIZE = 50000                                                          # Rows parsed at a time when streaming the Accidents & Casualties
+
+# Traffic Counts: only the variables used further on are parsed, with compact types
+
+TC_FILES = ['AADF-data-major-roads','AADF-data-minor-roads']
+TC_COUNTS = ['FdPC','Fd2WMV','FdCar','FdBUS','FdLGV','FdHGVR2','FdHGVR3','FdHGVR4','FdHGVA3','FdHGVA5','FdHGVA6','FdHGV','FdAll_MV']
+TC_LINKS = ['A-Junction','B-Junction','LenNet']                             # The road link each Count Point covers (see cycle_safety.links)
+TC_DTYPES = dict({'AADFYear':'int16','CP':'int32','Road':'category','S Ref E':'int32','S Ref N':'int32'}, **{col:'int32' for col in TC_COUNTS},
+                 **{'A-Junction':'category','B-Junction':'category','LenNet':'float32'})
+
+# Casualties: the variables the later stages need from each STATS19 table (only these are parsed), with compact types
+
+CAS_DTYPES = {'Accident_Index':'str','Casualty_Class':'int8','Sex_of_Casualty':'int8','Age_of_Casualty':'int16','Casualty_Severity':'int8','Casualty_Type':'int8'}
+ACC_DTYPES = {'Accident_Index':'str','Police_Force':'int16','Longitude':'float64','Latitude':'float64','Junction_Detail':'int8','Junction_Control':'int8',
+              'Number_of_Vehicles':'int16','Number_of_Casualties':'int16','Date':'str','Day_of_Week':'int8','Time':'str','1st_Road_Class':'int8',
+              '1st_Road_Number':'int16','Road_Type':'int8','Speed_limit':'int16','Light_Conditions':'int8','Weather_Conditions':'int8',
+              'Road_Surface_Conditions':'int8','Urban_or_Rural_Area':'int8'}
+VEH_DTYPES = {'Accident_Index':'str','Vehicle_Reference':'int16','Vehicle_Type':'int8','Vehicle_Manoeuvre':'int8','Junction_Location':'int8',
+              '1st_Point_of_Impact':'int8','Sex_of_Driver':'int8','Age_of_Driver':'int16','Journey_Purpose_of_Driver':'int8'}
+
+TABLE_DTYPES = {'Accidents': ACC_DTYPES, 'Casualties': CAS_DTYPES, 'Vehicles': VEH_DTYPES}
+CAS_COLS, ACC_COLS, VEH_COLS = list(CAS_DTYPES), list(ACC_DTYPES), list(VEH_DTYPES)
+
+
+@contextlib.contextmanager
+def open_zipped_csv(archive, file, spool_size=SPOOL_SIZE):
+
+    '''Opens a csv file held in a zip file inside the (already open) DfT archive, yielding the open csv.
+    The inner zip is copied into a spooled buffer (in memory unless it is larger than spool_size) so nothing is extracted to disk.'''
+
+    with archive.open('data/{}.zip'.format(file)) as inner, tempfile.SpooledTemporaryFile(max_size=spool_size) as buffer:
+        shutil.copyfileobj(inner, buffer)                                    # Level 1 read (zip files need a seekable file)
+        with zipfile.ZipFile(buffer, mode='r') as ind_file, ind_file.open('{}.csv'.format(file)) as csv:
+            yield csv
+
+
+def iter_zipped_csv(archive, file, spool_size=SPOOL_SIZE, chunk_size=CHUNK_SIZE, **kwargs):
+
+    '''Parses a csv file held in a zip file inside the (already open) DfT archive chunk_size rows at a time, yielding each chunk as a dataframe
+    (see open_zipped_csv). Any keyword arguments are passed on to pd.read_csv.'''
+
+    with open_zipped_csv(archive, file, spool_size) as csv:
+        yield from pd.read_csv(csv, chunksize=chunk_size, **kwargs)         # Level 2 read, a chunk at a time
+
+
+def read_zipped_csv(archive, file, chunk_filter=None, spool_size=SPOOL_SIZE, chunk_size=CHUNK_SIZE, **kwargs):
+
+    '''Reads a csv file held in a zip file inside the (already open) DfT archive straight into a dataframe (see open_zipped_csv).
+    If a chunk_filter function is given the csv is parsed chunk_size rows at a time (see iter_zipped_csv) and only the rows it keeps are held in memory.
+    Any keyword arguments are passed on to pd.read_csv.'''
+
+    if chunk_filter is not None:
+        chunks = iter_zipped_csv(archive, file, spool_size, chunk_size, **kwargs)
+        return pd.concat([chunk_filter(chunk) for chunk in chunks], ignore_index=True)
+
+    with open_zipped_csv(archive, file, spool_size) as csv:
+        return pd.read_csv(csv, **kwargs)                                    # Level 2 read
+
+
+def load_counts(path, years):
+
+    '''Loads the major and minor road Traffic Counts for the given years, filtering on AADFYear while parsing.
+    The road link columns (TC_LINKS) are left blank for files which don't have them (e.g. the minor roads).'''
+
+    with zipfile.ZipFile(os.path.join(path, COUNTS_FILE), mode='r') as tc_files:    # Opening the archive once for all the files
+        frames = [read_zipped_csv(tc_files, file, usecols=lambda col: col in TC_DTYPES, dtype=TC_DTYPES,
+                                  chunk_filter=lambda chunk: chunk[chunk['AADFYear'].isin(years)]) for file in TC_FILES]
+
+    df_tc_raw = pd.concat(frames, ignore_index=True).reindex(columns=list(TC_DTYPES))
+    for col in ['Road','A-Junction','B-Junction']:
+        df_tc_raw[col] = df_tc_raw[col].astype('category')                   # Chunks & files each have their own categories
+
+    return df_tc_raw
+
+
+def encode_index(df, keys):
+
+    '''Adds the Accident_Id (the position of the Accident Index in keys, -1 if it isn't there) to a table as its first column.'''
+
+    df.insert(0, 'Accident_Id', keys.get_indexer(df['Accident_Index']).astype('int32' if len(keys) < 2 ** 31 else 'int64'))
+
+    return df
+
+
+class Stats19(object):
+
+    '''Handles on the STATS19 tables (Accidents, Casualties and Vehicles) of one year, e.g. Stats19(path, 2015)['Vehicles'].
+    Each table is only read from the archive the first time it's used, and then only the columns declared for it are parsed, with their
+    dtypes (TABLE_DTYPES, plus any extra dtypes given for a table). The Accident Index (a 13 character string) is encoded as a dense integer id,
+    Accident_Id, numbered in order of the Accidents table, which every join and de-duplication further on uses.
+    The archive is opened once, when the first table is read, and kept open for the others until close() (or the end of a with block).'''
+
+    def __init__(self, path, year, dtypes=None):
+
+        self.path = path
+        self.year = year
+        self.dtypes = {table: dict(TABLE_DTYPES.get(table, {}), **(dtypes or {}).get(table, {})) for table in set(TABLE_DTYPES) | set(dtypes or {})}
+        self.tables = {}
+        self.keys = None
+        self.cas_files = None                                                # The open archive
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+    def archive(self):
+
+        '''The archive of the STATS19 tables, opened the first time it's needed.'''
+
+        if self.cas_files is None:
+            self.cas_files = zipfile.ZipFile(os.path.join(self.path, CASUALTIES_FILE), mode='r')
+
+        return self.cas_files
+
+    def close(self):
+
+        '''Closes the archive (it's opened again should another table be read).'''
+
+        if self.cas_files is not None:
+            self.cas_files.close()
+            self.cas_files = None
+
+    def read(self, table):
+
+        '''Reads the declared columns of a table from the archive.'''
+
+        dtypes = self.dtypes[table]
+        df = read_zipped_csv(self.archive(), 'DfTRoadSafety_{}_{}'.format(table, self.year), dtype=dtypes,
+                             usecols=lambda col: col.lstrip('﻿') in dtypes)            # The Accident Index header starts with a wierd character
+
+        return self.declared(df, table)
+
+    def chunks(self, table, chunk_size=STREAM_SIZE):
+
+        '''Reads the declared columns of a table from the archive chunk_size rows at a time, yielding each chunk (not keyed, see stream_casualties).'''
+
+        dtypes = self.dtypes[table]
+        for df in iter_zipped_csv(self.archive(), 'DfTRoadSafety_{}_{}'.format(table, self.year), chunk_size=chunk_size, dtype=dtypes,
+                                  usecols=lambda col: col.lstrip('﻿') in dtypes):
+            yield self.declared(df, table)
+
+    def declared(self, df, table):
+
+        '''The declared columns of a table, in order.'''
+
+        df.rename(columns={'﻿Accident_Index':'Accident_Index'}, inplace=True)
+
+        return df[list(self.dtypes[table])]
+
+    def __getitem__(self, table):
+
+        '''The table, keyed by Accident_Id (read on first use).'''
+
+        if table not in self.tables:
+            if self.keys is None:
+                accidents = self.read('Accidents')
+                self.keys = pd.Index(accidents['Accident_Index'].unique())
+                self.tables['Accidents'] = encode_index(accidents, self.keys)
+            if table not in self.tables:
+                self.tables[table] = encode_index(self.read(table), self.keys)
+
+        return self.tables[table]
+
+
+def load_casualties(path, year, tables=None, region=None):
+
+    '''Loads the Accidents and Casualties tables for the given year (or from the Stats19 tables given) and merges them into one row per casualty,
+    keyed by Accident_Id. If a Region is given (see cycle_safety.region) only the Accidents inside it are kept, straight after they're read.'''
+
+    if tables is None:
+        with Stats19(path, year, region.dtypes() if region else None) as tables:   # The archive is opened once for both tables
+            return load_casualties(path, year, tables, region)
+
+    df_a, df_c = tables['Accidents'], tables['Casualties']
+    if region:
+        df_a = region.select_accidents(df_a)
+
+    # Duplicates are found & the tables joined on the integer ids rather than the Accident Index strings
+
+    df_a = df_a[~df_a.drop(columns='Accident_Index').duplicated()]
+    df_c = df_c[~df_c.drop(columns='Accident_Index').duplicated()]
+    df_cas = df_c.merge(df_a.drop(columns='Accident_Index'), on='Accident_Id', how='inner')   # Unique rows joined on a key are already unique
+
+    return df_cas.reset_index(drop=True)
+
+
+def accident_blocks(chunks):
+
+    '''Regroups chunks of Accidents so that the rows of an Accident Index are never split between two (a chunk's trailing Accident Index is
+    moved to the next one).'''
+
+    chunks = iter(chunks)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        following = next(chunks, None)
+        if following is not None and len(chunk):
+            last = chunk['Accident_Index'].values == chunk['Accident_Index'].iat[-1]
+            following = pd.concat([chunk[last], following], ignore_index=True)
+            chunk = chunk[~last]
+        if len(chunk):
+            yield chunk
+        chunk = following
+
+
+def first_of(df, keys):
+
+    '''Position of the first row of df whose Accident Index is one of keys (a pd.Index), or None if there isn't one.'''
+
+    found = np.flatnonzero(keys.get_indexer(df['Accident_Index']) >= 0)
+
+    return found[0] if len(found) else None
+
+
+def stream_casualties(path, year, chunk_size=STREAM_SIZE, region=None):
+
+    '''Yields the merged Casualties of a year (as load_casualties) a block of about chunk_size Accidents at a time, so only one block of each table
+    is ever held in memory. The Accident_Id's run on from one block to the next, so every block is numbered as load_casualties would number it.
+    The Casualties table must list the Casualties in the order of their Accidents in the Accidents table (as the DfT files do): the Casualties of a
+    block are read up to the first Casualty of the next block. Casualties whose Accident is missing are dropped (as load_casualties does).'''
+
+    with Stats19(path, year, region.dtypes() if region else None) as tables:   # Both tables are streamed from the one open archive
+        blocks = accident_blocks(tables.chunks('Accidents', chunk_size))
+        casualties = tables.chunks('Casualties', chunk_size)
+        buffer = None                                                        # Casualties read but not yet given to a block
+        offset = 0                                                           # Accident_Id of the block's first Accident
+
+        df_a = next(blocks, None)
+        while df_a is not None:
+            df_next = next(blocks, None)                                     # Looking a block ahead to know where this block's Casualties end
+            keys = pd.Index(df_a['Accident_Index'].unique())
+            next_keys = pd.Index([] if df_next is None else df_next['Accident_Index'].unique())
+
+            # Reading Casualties until one of the next block's turns up (or they run out)
+
+            end = None if buffer is None else first_of(buffer, next_keys)
+            while end is None:
+                chunk = next(casualties, None)
+                if chunk is None:
+                    break
+                end = first_of(chunk, next_keys)
+                end = None if end is None else end + (len(buffer) if buffer is not None else 0)
+                buffer = chunk if buffer is None else pd.concat([buffer, chunk], ignore_index=True)
+
+            if buffer is None:
+                buffer = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in tables.dtypes['Casualties'].items()})
+            end = len(buffer) if end is None else end
+            df_c, buffer = buffer.iloc[:end].reset_index(drop=True), buffer.iloc[end:].reset_index(drop=True)
+
+            df_a, df_c = (encode_index(df.copy(), keys) for df in (df_a.reset_index(drop=True), df_c))
+            for df in (df_a, df_c):
+                df['Accident_Id'] = np.where(df['Accident_Id'] >= 0, df['Accident_Id'].astype('int64') + offset, -1)
+            offset += len(keys)
+
+            yield load_casualties(path, year, {'Accidents': df_a, 'Casualties': df_c}, region)
+
+            df_a = df_next
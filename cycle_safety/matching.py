@@ -0,0 +1,227 @@
+'''Matching each Casualty with its k nearest Count Points, first on the same road name and failing that on the same road type.'''
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .projection import haversine, lonlat_to_bng
+
+
+K_NEAREST = 2                                                                # Number of Count Points each Casualty is matched with
+PARALLEL_MIN = 10000                                                         # Fewer points than this are always matched in this process
+MATCH_TYPES = ['Road Link','Road Name','Road Type','None']                   # How a Casualty can be matched (its Assign_Type)
+
+
+def numbered(cols, k=K_NEAREST):
+
+    '''Numbers each variable for each of the k Count Points (e.g. Distance_1, Distance_2).'''
+
+    return [col + '_' + str(j) for col in cols for j in range(1, k + 1)]
+
+
+def knn_cols(k=K_NEAREST):
+
+    '''The columns of the Knn dataframe.'''
+
+    return ['Accident_Id','Assign_Type','Road_Name','1st_Road_Class'] + numbered(['Distance','Metres','CP_Index'], k)
+
+
+def build_tree(coords, rows, size):
+
+    '''Builds the KD Tree of the Count Points in rows (of coords) with known co-ordinates, and the lookup from tree positions to df_tc rows
+    (the extra last entry, size, stands for 'no Count Point'). The tree is None if none of the Count Points are located.'''
+
+    located = rows[np.isfinite(coords[rows]).all(axis=1)]                    # Count Points with known co-ordinates
+
+    return cKDTree(coords[located]) if len(located) else None, np.append(located, size)
+
+
+def query_tree(tree, lookup, points, k=K_NEAREST, max_distance=None):
+
+    '''Queries a tree (see build_tree) with every point in one vectorised call, leaving out points with missing co-ordinates.
+    Unmatched points are returned with infinite distances and an index of 'no Count Point' (as when fewer than k Count Points exist, or with
+    a max_distance, fewer than k are closer than it: the tree then stops searching beyond it).
+    It returns the following arrays, each of shape (number of points, k):
+    * Distances to the k nearest Count Points
+    * df_tc rows of the k nearest Count Points'''
+
+    dists = np.full((len(points), k), np.inf)                                # Default distances for unmatched points
+    indexes = np.full((len(points), k), lookup[-1])                          # Default indexes for unmatched points
+    valid = np.isfinite(points).all(axis=1)                                  # Points with known co-ordinates
+
+    if valid.any() and tree is not None:
+        d, i = tree.query(points[valid], k=k, distance_upper_bound=np.inf if max_distance is None else max_distance)   # All the points at once
+        dists[valid] = d.reshape(-1, k)
+        indexes[valid] = lookup[i.reshape(-1, k)]
+
+    return dists, indexes
+
+
+def group_rows(index, col, group):
+
+    '''The df_tc rows of the Count Points of a Road Name (col 'Road_Name') or Road Type (col '1st_Road_Class') group.'''
+
+    return (index.name_rows if col == 'Road_Name' else index.type_rows)[group]
+
+
+def group_tree(index, col, group):
+
+    '''The KD Tree and lookup (see build_tree) of a Road Name or Road Type group of Count Points. Each tree is built once and kept on the index.'''
+
+    key = (col, group)
+    if key not in index.trees:
+        index.trees[key] = build_tree(index.coords, group_rows(index, col, group), index.size)
+
+    return index.trees[key]
+
+
+def knn_query(index, col, group, points, k=K_NEAREST, max_distance=None):
+
+    '''Queries the KD Tree of a group of Traffic Count Points (see group_tree) with every Casualty Point in one vectorised call (see query_tree).'''
+
+    return query_tree(*group_tree(index, col, group), points, k, max_distance)
+
+
+def assign(index, names, classes):
+
+    '''Decides how each Casualty will be matched: returns masks of those matched on Road Name (it's known) and, failing that, on Road Type.'''
+
+    by_name = names.isin(index.road_set).values                              # Roadname is known so match on that
+    by_type = ~by_name & classes.isin(index.type_set).values                 # Else match based upon the Road Class
+
+    return by_name, by_type
+
+
+def grouped(mask, col, values):
+
+    '''The (col, group, positions) groups of the masked points by their Road Name (col 'Road_Name') or Road Type (col '1st_Road_Class') values.'''
+
+    rows = np.flatnonzero(mask)
+
+    return [(col, group, rows[pos]) for group, pos in values.iloc[rows].groupby(values.iloc[rows], sort=False, observed=True).indices.items()]
+
+
+def query_groups(index, points, groups, k=K_NEAREST, processes=None, grid=None, max_distance=None):
+
+    '''Queries the tree of each (col, group, positions) group with its points: through the grid first when there is one, and in a pool of
+    processes when there are enough points left. Returns the (points, k) distances and df_tc rows (nan for points in no group).'''
+
+    if grid is not None:
+        dists, indexes, groups = grid.match(index, points, groups, k, max_distance)   # Leaving only the points the grid can't match to the trees
+    else:
+        dists = np.full((len(points), k), np.nan)
+        indexes = np.full((len(points), k), np.nan)
+
+    if processes and processes > 1 and sum(len(pos) for _, _, pos in groups) >= PARALLEL_MIN:
+        from .parallel import parallel_knn
+        matched = np.concatenate([pos for _, _, pos in groups])
+        dists[matched], indexes[matched] = (a[matched] for a in parallel_knn(index, points, groups, k, processes, max_distance))
+    else:
+        for col, group, pos in groups:
+            dists[pos], indexes[pos] = knn_query(index, col, group, points[pos], k, max_distance)
+
+    return dists, indexes
+
+
+def match_points(index, points, names, classes, k=K_NEAREST, processes=None, grid=None, max_distance=None):
+
+    '''Matches points (Lon / Lat) on the given Road Names and Road Types (Series) with their k nearest Count Points, first on the Road Name
+    and failing that on the Road Type. Points are grouped by Road Name (or Road Type) so that each group's tree is queried once with the whole group.
+    If the index matches in BNG the points are projected to BNG in one go and the distances are in metres. With processes (> 1) the groups
+    are queried in a pool of processes (see cycle_safety.parallel), which gives the same matches. With a grid (a LookupGrid of the index,
+    see cycle_safety.grid) most points are matched from the grid and only the rest with the trees.
+    With a max_distance only Count Points closer than it are matched: points with none on their Road Name that close cascade to their Road Type,
+    and points with none on either aren't matched. Points without co-ordinates, or whose group has no located Count Points, aren't matched either.
+    Returns the (points, k) distances and df_tc rows (nan for points which can't be matched) and the by_name / by_type masks.'''
+
+    by_name, by_type = assign(index, names, classes)
+
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if index.match_bng:
+        points = np.column_stack(lonlat_to_bng(points[:, 0], points[:, 1]))   # Projecting all the points at once
+
+    # One query per Road Name / Road Type group
+
+    groups = grouped(by_name, 'Road_Name', names) + grouped(by_type, '1st_Road_Class', classes)
+    dists, indexes = query_groups(index, points, groups, k, processes, grid, max_distance)
+
+    if max_distance is not None:
+        near = indexes[:, 0] < index.size                                    # A Count Point closer than max_distance (nan isn't)
+        cascade = by_name & ~near & classes.isin(index.type_set).values      # Too far on the Road Name so try the Road Type
+        if cascade.any():
+            type_dists, type_indexes = query_groups(index, points, grouped(cascade, '1st_Road_Class', classes), k, processes, grid, max_distance)
+            dists[cascade], indexes[cascade] = type_dists[cascade], type_indexes[cascade]
+        by_name, by_type = by_name & near, by_type | cascade                 # Cascaded points are matched on their Road Type alone
+
+    found = indexes[:, 0] < index.size                                       # Points without co-ordinates or Count Points to match aren't
+    by_name, by_type = by_name & found, by_type & found
+    dists[~(by_name | by_type)] = np.nan                                      # Else no match
+    indexes[~(by_name | by_type)] = np.nan
+
+    return dists, indexes, by_name, by_type
+
+
+def metres(index, points, dists, indexes):
+
+    '''The distances in metres of the matched Count Points from the points (Lon / Lat): the distances themselves when the index matches in BNG,
+    otherwise the haversine distances to the Count Points' Lon / Lat, all k at once. nan where there's no Count Point.'''
+
+    if index.match_bng:
+        return np.where(np.isinf(dists), np.nan, dists)
+
+    rows = np.where(np.isnan(indexes), index.size, indexes).astype(int)
+    lonlat = index.values(['Lon_S','Lat_S'])[rows]                         # (points, k, 2), nan's for 'no Count Point'
+
+    return haversine(points[:, 0:1], points[:, 1:2], lonlat[:, :, 0], lonlat[:, :, 1])
+
+
+def match_counts(assign_types):
+
+    '''The number of each match type (MATCH_TYPES) in an Assign_Type column (missing values are counted as 'None', e.g. unmatched Casualties).'''
+
+    assign_types = np.asarray(assign_types, dtype=object)
+    counts = {match: int((assign_types == match).sum()) for match in MATCH_TYPES[:-1]}
+    counts['None'] = len(assign_types) - sum(counts.values())
+
+    return counts
+
+
+def knn_match(df_cas, index, k=K_NEAREST, processes=None, grid=None, max_distance=None, links=None):
+
+    '''K Nearest Neighbours Machine Learning algortihm to match the Casualty Points with the k most appropriate Traffic Count Points.
+    The Algorithm firstly tries to match the specific road name (e.g. A315) and if no match can be made, it matches on Road Type (e.g. ('A' Road)).
+    See match_points for how the matching is done (and processes for matching in parallel, grid for matching from a lookup grid and max_distance
+    for the furthest a Count Point may be). With links (a LinkIndex of the index, see cycle_safety.links) Casualties on a named road with
+    links are snapped to the link they're on instead and matched with its Count Point alone ('Road Link').
+    It returns a dataframe (one row per accident location) with the following variables:
+    * Accident Id
+    * Assign Type
+    * Road Name
+    * Road Type
+    * Distance to relevent Count Points 1 to k (nan when there's no such Count Point)
+    * Distance in metres to relevent Count Points 1 to k (the same as the Distance when matching in BNG, see metres)
+    * df_tc row of Relevent Count Points 1 to k'''
+
+    df = df_cas[['Road_Name','Accident_Id','1st_Road_Class','Longitude','Latitude']].drop_duplicates()
+
+    points = df[['Longitude','Latitude']].values
+    if links is None:
+        by_link = np.zeros(len(df), dtype=bool)
+        dists, indexes, by_name, by_type = match_points(index, points, df['Road_Name'], df['1st_Road_Class'], k, processes, grid, max_distance)
+    else:
+        link_dists, link_rows, by_link = links.snap(points, df['Road_Name'], max_distance)
+        dists, indexes = np.full((len(df), k), np.inf), np.full((len(df), k), float(index.size))
+        by_name, by_type = np.zeros(len(df), dtype=bool), np.zeros(len(df), dtype=bool)
+        dists[by_link, 0], indexes[by_link, 0] = link_dists[by_link], link_rows[by_link]   # The one Count Point of the link
+
+        rest = ~by_link                                                      # The rest are matched as without links
+        dists[rest], indexes[rest], by_name[rest], by_type[rest] = match_points(index, points[rest], df['Road_Name'][rest], df['1st_Road_Class'][rest],
+                                                                                k, processes, grid, max_distance)
+
+    df_knn = df[['Accident_Id','Road_Name','1st_Road_Class']].astype({'Road_Name': object, '1st_Road_Class': object})
+    df_knn['Assign_Type'] = np.select([by_link, by_name, by_type], ['Road Link','Road Name','Road Type'], 'None')
+    df_knn.loc[~(by_link | by_name | by_type), ['Road_Name','1st_Road_Class']] = 'None'   # Else return blank values
+    df_knn[numbered(['Distance'], k)] = np.where(np.isinf(dists), np.nan, dists)   # Count Points which weren't found have no distance
+    df_knn[numbered(['Metres'], k)] = metres(index, points, dists, indexes)
+    df_knn[numbered(['CP_Index'], k)] = indexes
+
+    return df_knn[knn_cols(k)].drop_duplicates()                             # Removing duplicates caused by multiple casualties per Accident Index
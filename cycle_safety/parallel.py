@@ -0,0 +1,114 @@
+'''Matching the Road Name / Road Type groups in a pool of processes (see matching.match_points with processes).
+
+The Count Point co-ordinates, the points, the points' order by group and the results are held in memory-mapped arrays (in /dev/shm where there
+is one) which every worker maps, so none of them are pickled: each task is just the bounds of a group's Count Points and points in those arrays.
+The largest groups are scheduled first and a group with many points (e.g. the 'U' roads) is split into pieces, so one group doesn't hold up the
+rest. Every piece builds & queries its tree exactly as the serial path does (build_tree / query_tree), so the matches are the same.'''
+
+import math
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .matching import K_NEAREST, build_tree, group_rows, query_tree
+
+
+PIECES = 4                                                                   # A group is split into pieces of at most 1 / (processes * PIECES) of the points
+SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None              # Where the arrays are mapped from (memory backed where possible)
+OUTPUTS = ['dists', 'indexes']                                               # The arrays the workers write to
+
+_arrays = {}                                                                 # The arrays mapped by a worker
+_trees = {}                                                                  # The trees a worker has built, by the bounds of their Count Points
+
+
+def share(directory, name, array):
+
+    '''Copies an array into a memory-mapped file in directory. Returns its spec (file, dtype, shape).'''
+
+    spec = (os.path.join(directory, name + '.npy'), array.dtype.str, array.shape)
+    if array.size:                                                           # Empty arrays can't be mapped so are made afresh by attach
+        mapped = np.memmap(spec[0], dtype=array.dtype, mode='w+', shape=array.shape)
+        mapped[:] = array
+        mapped.flush()
+
+    return spec
+
+
+def attach(specs):
+
+    '''Maps the shared arrays in a worker.'''
+
+    _trees.clear()
+    for name, (file, dtype, shape) in specs.items():
+        if np.prod(shape):
+            _arrays[name] = np.memmap(file, dtype=dtype, mode='r+' if name in OUTPUTS else 'r', shape=shape)
+        else:
+            _arrays[name] = np.empty(shape, dtype=dtype)
+
+
+def query_piece(task):
+
+    '''Matches one piece of a group: builds (or re-uses) the tree of the group's Count Points and queries it with the piece's points, writing
+    the distances & df_tc rows straight into the shared results. Returns the number of points matched.'''
+
+    count_start, count_stop, start, stop, size, k, max_distance = task
+
+    key = (count_start, count_stop)
+    if key not in _trees:
+        _trees[key] = build_tree(_arrays['coords'], np.asarray(_arrays['count_rows'][count_start:count_stop]), size)
+
+    pos = np.asarray(_arrays['order'][start:stop])
+    _arrays['dists'][pos], _arrays['indexes'][pos] = query_tree(*_trees[key], _arrays['points'][pos], k, max_distance)
+
+    return stop - start
+
+
+def schedule(groups, count_bounds, processes):
+
+    '''Splits the groups into tasks (pieces of at most 1 / (processes * PIECES) of the points) and orders them largest first, by the cost of
+    building the group's tree plus querying it with the piece's points.'''
+
+    total = sum(len(pos) for _, _, pos in groups)
+    piece = max(1, math.ceil(total / (processes * PIECES)))
+
+    tasks, start = [], 0
+    for (count_start, count_stop), (_, _, pos) in zip(count_bounds, groups):
+        counts = count_stop - count_start
+        for begin in range(start, start + len(pos), piece):
+            end = min(begin + piece, start + len(pos))
+            cost = (counts + end - begin) * math.log2(counts + 2)
+            tasks.append((cost, (count_start, count_stop, begin, end)))
+        start += len(pos)
+
+    return [task for _, task in sorted(tasks, key=lambda task: -task[0])]
+
+
+def parallel_knn(index, points, groups, k=K_NEAREST, processes=None, max_distance=None):
+
+    '''Matches the points of each (col, group, positions) group with its k nearest Count Points (closer than max_distance when given) in a
+    pool of processes.
+    Returns the (points, k) distances and df_tc rows (nan for points in no group), as the serial path in match_points does.'''
+
+    order = np.concatenate([pos for _, _, pos in groups] + [np.array([], dtype=np.int64)]).astype(np.int64)
+    if not len(order):
+        return np.full((len(points), k), np.nan), np.full((len(points), k), np.nan)
+    rows = [group_rows(index, col, group) for col, group, _ in groups]
+    count_rows = np.concatenate(rows + [np.array([], dtype=np.int64)]).astype(np.int64)
+    ends = np.cumsum([len(r) for r in rows], dtype=np.int64)
+    count_bounds = list(zip(np.concatenate([[0], ends[:-1]]).tolist(), ends.tolist())) if rows else []
+
+    with tempfile.TemporaryDirectory(dir=SHARED_DIR, prefix='cycle-safety-') as directory:
+        arrays = {'coords': np.ascontiguousarray(index.coords, dtype=float), 'points': np.ascontiguousarray(points, dtype=float),
+                  'order': order, 'count_rows': count_rows,
+                  'dists': np.full((len(points), k), np.nan), 'indexes': np.full((len(points), k), np.nan)}
+        specs = {name: share(directory, name, array) for name, array in arrays.items()}
+        tasks = [task + (index.size, k, max_distance) for task in schedule(groups, count_bounds, processes)]
+
+        with ProcessPoolExecutor(processes, initializer=attach, initargs=(specs,)) as pool:
+            list(pool.map(query_piece, tasks))
+
+        dists, indexes = (np.array(np.memmap(specs[name][0], dtype=specs[name][1], mode='r', shape=specs[name][2])) for name in OUTPUTS)
+
+    return dists, indexes
@@ -0,0 +1,342 @@
+'''The Cycle Safety pipeline. Each stage is a function of its own:
+
+* load_counts / prepare_counts - load & clean the Traffic Counts, then index them with CountIndex
+* load_casualties - load & merge the Accidents and Casualties
+* decode_casualties - decode the STATS19 codes
+* knn_match - match each Casualty with its nearest Count Points
+* interpolate_counts - weight the Count Points' traffic counts into an estimate for each Casualty
+* merge_casualties / export_casualties - join the estimates on to every Casualty and write the output file
+
+run() chains them together for one year, optionally measuring each stage with an Instrument (see cycle_safety.instrument).
+run_years() does the same for several years, parsing the Traffic Counts once and running the years in a pool of processes.
+stream_year() runs a year a block of Accidents at a time, appending each block to the partitioned output, for years too big to hold in memory.
+The number of Casualties matched each way (Road Name, Road Type or None) is logged for every year (see log_matches).'''
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from .cache import cached
+from .counts import CountIndex, CountYears, prepare_counts
+from .cube import Cube
+from .decoding import decode_casualties
+from .export import (OUTPUT_NAME, PARTITION_FORMAT, POLICE_FORCES, PartitionWriter, export_casualties, export_partitions, merge_casualties,
+                     police_force_rows, write_manifest)
+from .grid import year_grid
+from .instrument import call
+from .interpolation import IDW_POWER, WEIGHTING, interpolate_counts
+from .links import LinkIndex
+from .loading import CASUALTIES_FILE, COUNTS_FILE, STREAM_SIZE, load_casualties, load_counts, stream_casualties
+from .matching import K_NEAREST, MATCH_TYPES, knn_match, match_counts
+from .region import select_counts
+
+
+logger = logging.getLogger(__name__)
+
+
+PATH = 'data/'                                                               # Directory holding the downloaded DfT zip files
+OUT = 'out/'                                                                 # Directory the output files are written to
+
+
+def fill_window(year, fill_years=None):
+
+    '''The years of Traffic Counts a year's counts are filled in from: the fill_years either side of it (just the year without fill_years).'''
+
+    return list(range(year - (fill_years or 0), year + (fill_years or 0) + 1))
+
+
+def counts_params(year, bounds=None, fill_years=None, growth=None):
+
+    '''The cache params of a year's cleaned Traffic Counts.'''
+
+    params = {'year': year, 'bounds': bounds}
+    if fill_years:
+        params.update(fill_years=fill_years, growth=growth)
+
+    return params
+
+
+def fill_counts(count_years, year, fill_years, growth=None, stage=call):
+
+    '''The raw Traffic Counts of a year with the Count Points it's missing filled in from the nearest year (up to fill_years away) they were
+    surveyed, grown by growth (see CountYears.year). Logs how many were filled in.'''
+
+    df_tc_raw = stage('fill_counts', count_years.year, year, fill_years, growth)
+    logger.info('%s: %s of %s Count Points filled in from other years', year, int((df_tc_raw['AADFYear'] != year).sum()), len(df_tc_raw))
+
+    return df_tc_raw
+
+
+def clean_counts(year, path=PATH, df_tc_raw=None, stage=call, cache=None, bounds=None, fill_years=None, growth=None):
+
+    '''The cleaned Traffic Counts of a year: from the cache when there is one, otherwise cleaned from df_tc_raw (loaded from the zip file when not given).
+    Only the Count Points inside the BNG bounds (west, south, east, north) are kept when bounds are given. With fill_years the Count Points
+    which weren't surveyed in the year are filled in from the nearest year within fill_years that they were, their counts grown by growth
+    (see fill_counts); a df_tc_raw given is then the year's counts already filled in.'''
+
+    def build():
+        if df_tc_raw is not None:
+            df_raw = df_tc_raw
+        elif fill_years:
+            count_years = stage('count_years', CountYears, stage('load_counts', load_counts, path, fill_window(year, fill_years)))
+            df_raw = fill_counts(count_years, year, fill_years, growth, stage)
+        else:
+            df_raw = stage('load_counts', load_counts, path, [year])
+        if bounds:
+            df_raw = stage('select_counts', select_counts, df_raw, bounds)
+        return stage('prepare_counts', prepare_counts, df_raw)
+
+    return cached(cache, 'counts', [os.path.join(path, COUNTS_FILE)], counts_params(year, bounds, fill_years, growth), build, stage)
+
+
+def lookup_grid(grid, year, index, k=K_NEAREST, stage=call):
+
+    '''The lookup grid of a year's Count Points kept in grid/{year} (built there the first time, see year_grid), or None without a grid directory.'''
+
+    if not grid:
+        return None
+
+    return stage('lookup_grid', year_grid, os.path.join(grid, str(year)), index, k)
+
+
+def log_matches(year, counts):
+
+    '''Logs how many of a year's Casualties were matched on Road Name, on Road Type and not at all (counts, see match_counts).'''
+
+    logger.info('%s: %s', year, ', '.join('{} {}'.format(counts[match], match) for match in MATCH_TYPES if counts[match] or match != 'Road Link'))
+
+
+def matching_options(match_bng=True, k=K_NEAREST, weighting=WEIGHTING, idw_power=IDW_POWER, match_processes=None, grid=None, max_distance=None,
+                     fill_years=None, growth=None, links=False):
+
+    '''The matching options of a year (see match_year) bundled into one dict, passed on to match_year by name.'''
+
+    return dict(match_bng=match_bng, k=k, weighting=weighting, idw_power=idw_power, match_processes=match_processes, grid=grid,
+                max_distance=max_distance, fill_years=fill_years, growth=growth, links=links)
+
+
+def match_year(year, path=PATH, df_tc_raw=None, stage=call, cache=None, region=None, *, match_bng=True, k=K_NEAREST, weighting=WEIGHTING,
+               idw_power=IDW_POWER, match_processes=None, grid=None, max_distance=None, fill_years=None, growth=None, links=False):
+
+    '''Runs the stages up to the final join for one year: loads & decodes the Casualties, cleans & indexes the year's Traffic Counts, matches
+    the Casualties with the Count Points and estimates their traffic counts. The decoded Casualties, cleaned Traffic Counts and Knn match table
+    are taken from the cache when one is given and they're in it. With a region only the Casualties inside it are loaded and only the Count Points
+    around them are indexed. The road groups are matched in a pool of match_processes processes when given (see cycle_safety.parallel), and
+    through the lookup grid kept in grid/{year} when a grid directory is given (see cycle_safety.grid). With max_distance Count Points further
+    than it aren't matched (see match_points). With fill_years the Count Points missing from the year are filled in from other years (see
+    clean_counts). With links the Casualties on named roads are snapped to their road link (see cycle_safety.links).
+    The matching options are keyword only, so they're passed on by name (e.g. as the matching dict of run_years).
+    Returns the full output dataframe (every Police Force in the region).'''
+
+    tc_file, cas_file = os.path.join(path, COUNTS_FILE), os.path.join(path, CASUALTIES_FILE)
+    params = {'year': year, 'region': region.key() if region else None}
+
+    df_cas = cached(cache, 'casualties', [cas_file], params,
+                    lambda: stage('decode_casualties', decode_casualties, stage('load_casualties', load_casualties, path, year, None, region)), stage)
+    bounds = region.count_bounds(df_cas) if region else None
+    index = stage('index_counts', CountIndex, clean_counts(year, path, df_tc_raw, stage, cache, bounds=bounds, fill_years=fill_years, growth=growth),
+                  match_bng)
+    knn_params = dict(params, k=k, match_bng=match_bng, grid=bool(grid), max_distance=max_distance)
+    if fill_years:
+        knn_params.update(fill_years=fill_years, growth=growth)
+    if links:
+        knn_params['links'] = True
+    df_knn = cached(cache, 'knn', [tc_file, cas_file], knn_params,
+                    lambda: stage('knn_match', knn_match, df_cas, index, k, match_processes, lookup_grid(grid, year, index, k, stage), max_distance,
+                                  stage('index_links', LinkIndex, index) if links else None), stage)
+    df_out = stage('interpolate_counts', interpolate_counts, df_knn, index, k, weighting, idw_power)
+    df_cas_out = stage('merge_casualties', merge_casualties, df_cas, df_out)
+    log_matches(year, match_counts(df_cas_out['Assign_Type']))
+
+    return df_cas_out
+
+
+def run(year, path=PATH, out=OUT, police_forces=POLICE_FORCES, match_bng=True, k=K_NEAREST, weighting=WEIGHTING, idw_power=IDW_POWER, name=OUTPUT_NAME,
+        instrument=None, cache=None, region=None, partition=None, threads=None, cube=None, match_processes=None, grid=None, max_distance=None,
+        fill_years=None, growth=None, links=False):
+
+    '''Runs every stage of the pipeline for one year and writes the Casualties of the given Police Forces to out/name, or with partition
+    ('csv.gz' or 'parquet') to a file per Police Force written by threads threads (see export_partitions).
+    Each stage is called through instrument when one is given (its report() then has the measurements of every stage), the intermediate
+    frames are kept in the cache when one is given (see cycle_safety.cache) and only the Casualties in the region are processed when one
+    is given (see cycle_safety.region). The exposure-risk cube of every Casualty is saved to the file cube when one is given (see cycle_safety.cube).
+    With match_processes the matching is spread over a pool of processes (see cycle_safety.parallel) and with grid (a directory) it goes
+    through a lookup grid of the Count Points (see cycle_safety.grid). With max_distance no Count Point further than it is matched and with
+    fill_years the Count Points missing from the year are filled in from the nearest year within fill_years (grown by growth, see clean_counts).
+    With links the Casualties on named roads are matched with the Count Point of the road link they're on (see cycle_safety.links).
+    Returns the full output dataframe (every Police Force).'''
+
+    stage = instrument or call
+
+    df_cas_out = match_year(year, path, None, stage, cache, region, **matching_options(match_bng, k, weighting, idw_power, match_processes, grid,
+                                                                                        max_distance, fill_years, growth, links))
+    if cube:
+        stage('build_cube', Cube.build, df_cas_out).save(cube)
+    if partition:
+        stage('export_partitions', export_partitions, df_cas_out, out, year, police_forces, partition, threads)
+        write_manifest(out)
+    else:
+        stage('export_casualties', export_casualties, df_cas_out, out, police_forces, name)
+
+    return df_cas_out
+
+
+def year_name(name, year):
+
+    '''Name of a year's output file when the years are written separately, e.g. Casualties_2015.csv (or a path, e.g. out/cube_2015.npz).'''
+
+    root, ext = os.path.splitext(name)
+
+    return '{}_{}{}'.format(root, year, ext)
+
+
+def _run_year(year, *, df_tc_raw, instrument, path, out, police_forces, name, combine, cache, region, partition, threads, cube, matching):
+
+    '''Runs one year of run_years (in a worker process). Writes the year's output file (or partitions), or returns the rows to output when
+    combining the years. Every argument but the year is passed by name, the matching options together as the matching dict (see
+    matching_options).
+    Returns the year, the number of Casualties processed, the rows to output (or None) and the Instrument.'''
+
+    stage = instrument or call
+
+    df_cas_out = match_year(year, path, df_tc_raw, stage, cache, region, **matching)
+    if cube:
+        stage('build_cube', Cube.build, df_cas_out).save(year_name(cube, year))
+    if partition:
+        stage('export_partitions', export_partitions, df_cas_out, out, year, police_forces, partition, threads)
+        return year, len(df_cas_out), None, instrument
+    if combine:
+        return year, len(df_cas_out), police_force_rows(df_cas_out, police_forces), instrument
+
+    stage('export_casualties', export_casualties, df_cas_out, out, police_forces, year_name(name, year))
+
+    return year, len(df_cas_out), None, instrument
+
+
+def run_years(years, path=PATH, out=OUT, police_forces=POLICE_FORCES, match_bng=True, k=K_NEAREST, weighting=WEIGHTING, idw_power=IDW_POWER,
+              name=OUTPUT_NAME, combine=False, processes=None, instrument=None, cache=None, region=None, partition=None, threads=None, cube=None,
+              match_processes=None, grid=None, max_distance=None, fill_years=None, growth=None, links=False):
+
+    '''Runs the pipeline for several years. The Traffic Counts of all the years (which aren't already in the cache) are parsed once and split
+    by AADFYear, then the years are run in a pool of processes (processes of them, by default one per year up to the number of CPUs; 1 runs them
+    one after another in this process). Each year is written to its own file (out/Casualties_2015.csv, ...) or, with combine, all the years are
+    written to out/name. With partition every year is written as a file per Police Force instead (see export_partitions) and out/manifest.json
+    lists them all. When an instrument is given each stage's measurements are recorded with its year. With a region only the Casualties
+    inside it (and the Count Points around them) are processed. With cube each year's exposure-risk cube is saved (e.g. cube_2015.npz for cube.npz).
+    Each year's matching is spread over match_processes processes when given (best with processes=1, else there are processes * match_processes)
+    and goes through the year's lookup grid in grid/{year} when grid is given. Count Points further than max_distance aren't matched when given.
+    With fill_years the Traffic Counts of every year needed are held as one CountYears and each year's missing Count Points are filled in from it.
+    With links the Casualties on named roads are snapped to their road link.
+    Returns a dictionary of the number of Casualties processed in each year.'''
+
+    stage = instrument or call
+    years = sorted(set(years))
+    processes = processes or min(len(years), os.cpu_count() or 1)
+    tc_file = os.path.join(path, COUNTS_FILE)
+
+    if cache:
+        cache.source_hash(os.path.join(path, CASUALTIES_FILE))               # Hashing the sources once, before the workers start
+
+    # With a region the Count Points kept depend on its Casualties, so the cache can't be checked before the workers run
+    missing = years if cache is None or region else [year for year in years
+                                                      if not cache.has('counts', [tc_file], counts_params(year, None, fill_years, growth))]
+    partitions = {}
+
+    if missing and fill_years:
+        count_years = stage('count_years', CountYears,
+                            stage('load_counts', load_counts, path, sorted({y for year in missing for y in fill_window(year, fill_years)})))
+        partitions = {year: fill_counts(count_years, year, fill_years, growth, stage) for year in missing}
+        del count_years
+    elif missing:
+        df_tc = stage('load_counts', load_counts, path, missing)
+        partitions = {year: df_tc.iloc[:0] for year in missing}              # Years with no Traffic Counts get an empty frame
+        partitions.update({year: df.reset_index(drop=True) for year, df in df_tc.groupby('AADFYear', sort=False)})
+        del df_tc
+
+    options = dict(path=path, out=out, police_forces=police_forces, name=name, combine=combine, cache=cache, region=region, partition=partition,
+                   threads=threads, cube=cube, matching=matching_options(match_bng, k, weighting, idw_power, match_processes, grid, max_distance,
+                                                                         fill_years, growth, links))
+    jobs = [dict(options, year=year, df_tc_raw=partitions.pop(year, None), instrument=instrument.partition(year) if instrument else None)
+            for year in years]
+
+    if processes == 1:
+        results = [_run_year(**job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = [future.result() for future in [pool.submit(_run_year, **job) for job in jobs]]
+
+    counts, frames = {}, []
+    for year, count, df_year, year_instrument in results:
+        counts[year] = count
+        frames.append(df_year)
+        if instrument:
+            instrument.add(year_instrument, year=year)
+
+    if partition:
+        write_manifest(out)
+    elif combine:
+        stage('export_casualties', export_casualties, pd.concat(frames, ignore_index=True), out, None, name)
+
+    return counts
+
+
+def stream_bounds(year, path, region, chunk_size=STREAM_SIZE):
+
+    '''The BNG box the Count Points of a streamed region are kept in (see Region.count_bounds): the box around every block of the region's
+    Casualties, found in a first pass which keeps nothing but the box. A bounding box needs no pass.'''
+
+    if region.bbox:
+        return region.count_bounds(None)
+
+    boxes = [box for box in (region.count_bounds(df_cas) for df_cas in stream_casualties(path, year, chunk_size, region)) if box]
+    if not boxes:
+        return None
+
+    return (min(box[0] for box in boxes), min(box[1] for box in boxes), max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+
+def stream_year(year, path=PATH, out=OUT, police_forces=POLICE_FORCES, match_bng=True, k=K_NEAREST, weighting=WEIGHTING, idw_power=IDW_POWER,
+                instrument=None, cache=None, region=None, partition=PARTITION_FORMAT, threads=None, chunk_size=STREAM_SIZE, match_processes=None,
+                grid=None, max_distance=None, fill_years=None, growth=None, links=False):
+
+    '''Runs the pipeline for one year without ever holding the year's Casualties in memory: the Traffic Counts are cleaned & indexed once, then
+    the Casualties are loaded a block of about chunk_size Accidents at a time (see stream_casualties), each block is decoded, matched, interpolated
+    and appended to the year's partitions (see PartitionWriter) before the next is read. So memory is set by chunk_size and the Count Points,
+    not by the number of Casualties. The partitions are the same as run() with partition writes (the csv's are in several gzip members).
+    Only the cleaned Traffic Counts (filled in from other years with fill_years, see clean_counts) are taken from (and kept in) the cache.
+    With a region that isn't a bounding box the Casualties are streamed twice, first to find the box the Count Points are kept in.
+    The match counts of every block are added up and logged once the year is done.
+    Returns the number of Casualties processed.'''
+
+    stage = instrument or call
+
+    bounds = stage('stream_bounds', stream_bounds, year, path, region, chunk_size) if region else None
+    index = stage('index_counts', CountIndex, clean_counts(year, path, None, stage, cache, bounds=bounds, fill_years=fill_years, growth=growth), match_bng)
+    lookup = lookup_grid(grid, year, index, k, stage)
+    link_index = stage('index_links', LinkIndex, index) if links else None
+    writer = PartitionWriter(out, year, police_forces, partition, threads)
+    blocks = stream_casualties(path, year, chunk_size, region)
+    count, matches = 0, dict.fromkeys(MATCH_TYPES, 0)
+
+    try:
+        while True:
+            df_cas = stage('load_casualties', next, blocks, None)
+            if df_cas is None:
+                break
+            df_cas = stage('decode_casualties', decode_casualties, df_cas)
+            df_knn = stage('knn_match', knn_match, df_cas, index, k, match_processes, lookup, max_distance, link_index)
+            df_out = stage('interpolate_counts', interpolate_counts, df_knn, index, k, weighting, idw_power)
+            df_cas_out = stage('merge_casualties', merge_casualties, df_cas, df_out)
+            stage('write_partitions', writer.write, df_cas_out)
+            count += len(df_cas_out)
+            for match, n in match_counts(df_cas_out['Assign_Type']).items():
+                matches[match] += n
+    finally:
+        writer.close()
+
+    write_manifest(out)
+    log_matches(year, matches)
+
+    return count
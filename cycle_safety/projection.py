@@ -0,0 +1,44 @@
+'''Conversions between British National Grid (BNG) Eastings / Northings and WGS84 Lon / Lat, and distances in metres between Lon / Lat.'''
+
+import functools
+
+import numpy as np
+from pyproj import Transformer
+
+
+BNG = '+proj=tmerc +lat_0=49 +lon_0=-2 +k=0.9996012717 +x_0=400000 +y_0=-100000 +ellps=airy +datum=OSGB36 +units=m +towgs84=446.448,-125.157,542.060,0.1502,0.2470,0.8421,-20.4894 +no_defs'
+WGS84 = '+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs'
+EARTH_RADIUS = 6371008.8                                                     # Mean radius of the Earth (metres)
+
+
+@functools.lru_cache(maxsize=None)
+def transformer(crs_from, crs_to):
+
+    '''Creates the Transformer between two projections the first time it's needed and reuses it afterwards.
+    always_xy keeps the axis order as x / y (i.e. Lon / Lat) whatever the projection.'''
+
+    return Transformer.from_crs(crs_from, crs_to, always_xy=True)
+
+
+def bng_to_lonlat(eastings, northings):
+
+    '''Converts arrays of Eastings / Northings (BNG) to arrays of Lon / Lat (WGS84) in one vectorised call.'''
+
+    return transformer(BNG, WGS84).transform(np.asarray(eastings, dtype=float), np.asarray(northings, dtype=float))
+
+
+def lonlat_to_bng(lons, lats):
+
+    '''Converts arrays of Lon / Lat (WGS84) to arrays of Eastings / Northings (BNG) in one vectorised call.'''
+
+    return transformer(WGS84, BNG).transform(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+
+
+def haversine(lons1, lats1, lons2, lats2):
+
+    '''The great circle distances (metres) between arrays of Lon / Lat, in one vectorised pass (the arrays broadcast, nan stays nan).'''
+
+    lons1, lats1, lons2, lats2 = (np.radians(np.asarray(a, dtype=float)) for a in (lons1, lats1, lons2, lats2))
+    a = np.sin((lats2 - lats1) / 2) ** 2 + np.cos(lats1) * np.cos(lats2) * np.sin((lons2 - lons1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
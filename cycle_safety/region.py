@@ -0,0 +1,119 @@
+'''Selecting a region (Police Forces, Local Authorities and / or a bounding box) before anything else is done, so the Casualties outside it are
+never decoded or matched and only the Count Points around it are indexed:
+
+    Region(police_forces=['Metropolitan Police','City of London'])          # London
+    Region(local_authorities=[1, 'E09000033'])                               # Local Authority (District) codes or (Highway) codes
+    Region(bbox=(-0.51, 51.28, 0.33, 51.69))                                 # Lon / Lat: west, south, east, north
+    Region(bbox=(503000, 155000, 562000, 201000), crs='bng')                 # BNG Eastings / Northings
+
+The Casualties are those inside every criterion given. The Count Points kept are those within buffer metres of the box around the Casualties
+(or around the bounding box), so Casualties near the edge of the region are still matched with the Count Points just outside it. A Casualty
+whose nearest Count Point on its road is further away than the buffer is matched as it would be with only the Count Points kept.'''
+
+import numpy as np
+
+from .decoding import DECODE_TABLES
+from .projection import lonlat_to_bng
+
+
+BUFFER = 10000                                                               # Metres around the region within which Count Points are kept
+LA_DTYPES = {'Local_Authority_(District)':'int16','Local_Authority_(Highway)':'str'}   # Extra Accidents variables needed for Local Authorities
+
+
+def police_force_codes(forces):
+
+    '''Turns any Police Force names (e.g. 'Metropolitan Police') into their codes (e.g. 1), leaving codes as they are.'''
+
+    codes = {name: code for code, name in DECODE_TABLES['Police_Force'].items()}
+
+    return [int(force) if str(force).isdigit() else codes[force] for force in forces]
+
+
+class Region(object):
+
+    '''A region to restrict a run to. See the module docstring for the options.'''
+
+    def __init__(self, police_forces=None, local_authorities=None, bbox=None, crs='lonlat', buffer=BUFFER):
+
+        if crs not in ('lonlat', 'bng'):
+            raise ValueError('Unknown bounding box crs: {}'.format(crs))
+
+        self.police_forces = police_force_codes(police_forces) if police_forces else None
+        self.districts = [int(la) for la in local_authorities if str(la).isdigit()] if local_authorities else []
+        self.highways = [la for la in local_authorities if not str(la).isdigit()] if local_authorities else []
+        self.bbox = tuple(bbox) if bbox else None
+        self.crs = crs
+        self.buffer = buffer
+
+    def key(self):
+
+        '''The region as a dictionary (used in the cache keys).'''
+
+        return {'police_forces': self.police_forces, 'districts': self.districts, 'highways': self.highways, 'bbox': self.bbox, 'crs': self.crs,
+                'buffer': self.buffer}
+
+    def dtypes(self):
+
+        '''The extra variables (and dtypes) of each STATS19 table needed to select the region.'''
+
+        return {'Accidents': LA_DTYPES} if self.districts or self.highways else {}
+
+    def select_accidents(self, df_a):
+
+        '''The Accidents inside the region (without the extra variables used to select them).'''
+
+        keep = np.ones(len(df_a), dtype=bool)
+
+        if self.police_forces:
+            keep &= df_a['Police_Force'].isin(self.police_forces).values
+        if self.districts or self.highways:
+            keep &= (df_a['Local_Authority_(District)'].isin(self.districts) | df_a['Local_Authority_(Highway)'].isin(self.highways)).values
+        if self.bbox:
+            x, y = self.points(df_a)
+            west, south, east, north = self.bbox
+            keep &= (x >= west) & (x <= east) & (y >= south) & (y <= north)
+
+        return df_a.loc[keep, [col for col in df_a if col not in LA_DTYPES]]
+
+    def points(self, df):
+
+        '''The Casualty locations in the bounding box's co-ordinates.'''
+
+        lon, lat = df['Longitude'].to_numpy(dtype=float), df['Latitude'].to_numpy(dtype=float)
+
+        return lonlat_to_bng(lon, lat) if self.crs == 'bng' else (lon, lat)
+
+    def count_bounds(self, df_cas):
+
+        '''The BNG box (west, south, east, north) the Count Points are kept in: the box around the region's Casualties (or the bounding box)
+        plus the buffer. Returns None if there's nothing to bound (no located Casualties).'''
+
+        if self.bbox and self.crs == 'bng':
+            x, y = np.array(self.bbox[0::2], dtype=float), np.array(self.bbox[1::2], dtype=float)
+        elif self.bbox:
+            t = np.linspace(0, 1, 11)                                        # Points along each edge as the box's edges curve in BNG
+            west, south, east, north = self.bbox
+            lon = np.concatenate([west + t * (east - west), west + t * (east - west), np.full(11, west), np.full(11, east)])
+            lat = np.concatenate([np.full(11, south), np.full(11, north), south + t * (north - south), south + t * (north - south)])
+            x, y = lonlat_to_bng(lon, lat)
+        else:
+            x, y = lonlat_to_bng(df_cas['Longitude'].to_numpy(dtype=float), df_cas['Latitude'].to_numpy(dtype=float))
+
+        located = np.isfinite(x) & np.isfinite(y)
+        if not located.any():
+            return None
+
+        x, y = x[located], y[located]
+
+        return (int(np.floor(x.min() - self.buffer)), int(np.floor(y.min() - self.buffer)),
+                int(np.ceil(x.max() + self.buffer)), int(np.ceil(y.max() + self.buffer)))
+
+
+def select_counts(df_tc_raw, bounds):
+
+    '''The raw Traffic Counts whose Count Points are inside the BNG bounds (Count Points with no location are left out).'''
+
+    west, south, east, north = bounds
+    e, n = df_tc_raw['S Ref E'], df_tc_raw['S Ref N']
+
+    return df_tc_raw[(e >= west) & (e <= east) & (n >= south) & (n <= north)].reset_index(drop=True)
@@ -0,0 +1,304 @@
+'''A local 'traffic at a point' service: the Count Points of a year are loaded & indexed once and every query is then answered from memory,
+matched (Road Name first, then Road Type) and weighted exactly as the pipeline matches & weights the Casualties. A point's road is named and
+classed as decode_casualties names & classes a Casualty's, so a motorway (e.g. M25) is 'Motorway' and, as in the pipeline, isn't matched.
+
+    service = TrafficService(2015, path='data/')
+    service.query(-0.1204, 51.5144, 'A4')                                   # {'assign_type': 'Road Name', 'FdPC': 1234.5, ...}
+    service.query_many(lons, lats, roads)                                    # A list of the same, one per point
+    service.reload(2016)                                                     # Queries carry on against 2015 until 2016 is ready
+    service.stats()                                                          # {'queries': ..., 'p50_ms': ..., 'p99_ms': ...}
+
+or over HTTP (JSON in & out) with ``python -m cycle_safety.service --year 2015 --data data/ --port 8765``:
+
+    GET  /traffic?lon=-0.1204&lat=51.5144&road=A4[&road_class=A]
+    POST /traffic    {"points": [{"lon": -0.1204, "lat": 51.5144, "road": "A4"}, ...]}
+    GET  /stats
+    POST /reload     {"year": 2016}
+
+The KD Tree of every Road Name and Road Type is built up front so no query pays for building one. A reload builds the new year alongside the
+old one and swaps it in when it's ready, so queries are answered throughout. Only the standard library is used for the HTTP server.'''
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from .counts import CountIndex
+from .decoding import road_class, road_name
+from .interpolation import FD_MEASURES, IDW_POWER, TC_COLS, WEIGHTING, interpolate, match_quality
+from .matching import K_NEAREST, group_tree, match_points, metres
+from .pipeline import PATH, clean_counts
+
+
+logger = logging.getLogger(__name__)
+
+HOST = '127.0.0.1'
+PORT = 8765
+LATENCIES = 100000                                                           # Number of the latest query latencies the percentiles are taken over
+MAX_BODY = 64 * 2 ** 20                                                      # Largest request body accepted (bytes)
+
+
+class YearCounts(object):
+
+    '''The indexed Count Points of one year along with their traffic counts as an array and a KD Tree per Road Name & Road Type.'''
+
+    def __init__(self, year, path=PATH, match_bng=True, cache=None, fill_years=None, growth=None):
+
+        self.year = year
+        self.index = CountIndex(clean_counts(year, path, cache=cache, fill_years=fill_years, growth=growth), match_bng)
+        self.values = self.index.values(TC_COLS)                             # (Count Points + 1, variables), the last row is 'no Count Point'
+        self.measures = self.values[:, [TC_COLS.index(m) for m in FD_MEASURES]]
+
+        for road_name in self.index.name_rows:
+            group_tree(self.index, 'Road_Name', road_name)
+        for road_type in self.index.type_rows:
+            group_tree(self.index, '1st_Road_Class', road_type)
+
+
+class TrafficService(object):
+
+    '''Answers 'what's the traffic at this point on this road' queries for a year of Count Points. See the module docstring.'''
+
+    def __init__(self, year, path=PATH, match_bng=True, k=K_NEAREST, weighting=WEIGHTING, idw_power=IDW_POWER, cache=None, max_distance=None,
+                 fill_years=None, growth=None):
+
+        self.path = path
+        self.match_bng = match_bng
+        self.k = k
+        self.weighting = weighting
+        self.idw_power = idw_power
+        self.cache = cache
+        self.max_distance = max_distance
+        self.fill_years = fill_years
+        self.growth = growth
+        self.counts = YearCounts(year, path, match_bng, cache, fill_years, growth)
+        self.latencies = deque(maxlen=LATENCIES)
+        self.reloading = None
+        self.lock = threading.Lock()                                         # One reload at a time
+
+    def query_many(self, lons, lats, roads, road_classes=None):
+
+        '''The traffic estimates at many points at once, one dictionary per point: how it was matched and its match quality, the matched
+        Count Points, their distances (and in metres) and weights and the estimate of each measure (None where the point couldn't be
+        matched). The Road Type of each point is taken from its road unless road_classes are given.'''
+
+        start = time.perf_counter()
+        counts = self.counts                                                 # Held for the whole query even if a reload swaps it meanwhile
+
+        roads = pd.Series(['' if road is None else str(road).strip().upper() for road in roads], dtype=object)
+        classes = roads.map(road_class) if road_classes is None else pd.Series(
+            [road_class(rc) if rc is not None else road_class(road) for rc, road in zip(road_classes, roads)], dtype=object)
+        names = road_name(classes, roads.str[1:]).astype(object).where(classes.notna(), '')   # Named as decode_casualties names the Casualties
+        points = np.column_stack([np.asarray(lons, dtype=float), np.asarray(lats, dtype=float)])
+
+        dists, indexes, by_name, by_type = match_points(counts.index, points, names, classes, self.k, max_distance=self.max_distance)
+        rows = np.where((by_name | by_type)[:, None], indexes, counts.index.size).astype(int)
+        found = rows < counts.index.size
+        matched = found.any(axis=1)                                          # Matched only when a Count Point was found
+        by_name, by_type = by_name & matched, by_type & matched
+        weights, estimates = interpolate(np.where(found, dists, np.inf), counts.measures[rows], found, self.weighting, self.idw_power)
+        assign_types = np.select([by_name, by_type], ['Road Name','Road Type'], 'None').astype(object)
+        in_metres = metres(counts.index, points, dists, indexes)
+        quality = match_quality(assign_types, in_metres, weights, found)
+
+        cps = counts.values[:, TC_COLS.index('CP')]
+        results = []
+        for i in range(len(points)):
+            lon, lat = (float(c) if np.isfinite(c) else None for c in points[i])
+            result = {'lon': lon, 'lat': lat, 'road': roads[i], 'year': counts.year,
+                      'assign_type': assign_types[i], 'match_quality': float(quality[i]),
+                      'road_name': names[i] if by_name[i] else None, 'road_class': classes[i] if matched[i] else None}
+            hit = found[i]
+            result['count_points'] = [int(cp) for cp in cps[rows[i][hit]]]
+            result['distances'] = dists[i][hit].tolist()
+            result['metres'] = in_metres[i][hit].tolist()
+            result['weights'] = weights[i][hit].tolist() if matched[i] else []
+            for j, measure in enumerate(FD_MEASURES):
+                result[measure] = float(estimates[i, j]) if hit.any() else None
+            results.append(result)
+
+        self.latencies.append(time.perf_counter() - start)
+
+        return results
+
+    def query(self, lon, lat, road, road_class=None):
+
+        '''The traffic estimate at a single point (see query_many).'''
+
+        return self.query_many([lon], [lat], [road], None if road_class is None else [road_class])[0]
+
+    def reload(self, year):
+
+        '''Loads & indexes another year and swaps it in once it's ready; queries are answered from the current year until then.
+        A year without any Count Points is refused (ValueError) and the current year is kept. Returns the year now being served.'''
+
+        with self.lock:
+            self.reloading = year
+            try:
+                counts = YearCounts(year, self.path, self.match_bng, self.cache, self.fill_years, self.growth)
+                if counts.index.size == 0:
+                    raise ValueError('There are no traffic counts for {}, still serving {}'.format(year, self.counts.year))
+                self.counts = counts                                         # A single reference swap so no query sees half a year
+            finally:
+                self.reloading = None
+
+        return self.counts.year
+
+    def stats(self):
+
+        '''The number of queries (in the latency window) and their 50th / 99th percentile & maximum latencies in milliseconds, along with
+        the year being served.'''
+
+        latencies = np.array(self.latencies) * 1000
+        stats = {'year': self.counts.year, 'count_points': self.counts.index.size, 'reloading': self.reloading, 'queries': len(latencies)}
+        for name, q in [('p50_ms', 50), ('p99_ms', 99), ('max_ms', 100)]:
+            stats[name] = float(np.percentile(latencies, q)) if len(latencies) else None
+
+        return stats
+
+
+# HTTP
+
+def to_json(value):
+
+    '''The response as JSON (numpy numbers written as plain numbers).'''
+
+    return json.dumps(value, default=float).encode()
+
+
+def points_query(service, params):
+
+    '''Answers a GET /traffic query string or a POST /traffic body.'''
+
+    if 'points' in params:
+        points = params['points']
+        return service.query_many([p['lon'] for p in points], [p['lat'] for p in points], [p.get('road') for p in points],
+                                  [p.get('road_class') for p in points])
+
+    return service.query(float(params['lon']), float(params['lat']), params.get('road'), params.get('road_class'))
+
+
+async def respond(service, method, target, body):
+
+    '''Dispatches a request. Returns the HTTP status and the JSON response.'''
+
+    url = urlsplit(target)
+    params = dict(parse_qsl(url.query))
+    if body:
+        params.update(json.loads(body))
+
+    if url.path == '/traffic' and method in ('GET', 'POST'):
+        return 200, points_query(service, params)
+    if url.path == '/stats' and method == 'GET':
+        return 200, service.stats()
+    if url.path == '/reload' and method == 'POST':
+        year = await asyncio.get_running_loop().run_in_executor(None, service.reload, int(params['year']))   # Queries are served meanwhile
+        return 200, {'year': year}
+
+    return 404, {'error': 'Unknown request: {} {}'.format(method, url.path)}
+
+
+async def handle(service, reader, writer):
+
+    '''Serves the requests of one connection (kept alive unless the client asks otherwise).'''
+
+    try:
+        while True:
+            request = await reader.readline()
+            if not request.strip():
+                break
+            method, target, version = request.decode('latin-1').split()
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY:
+                status, result = 413, {'error': 'Request body too large'}
+                body = b''
+            else:
+                body = await reader.readexactly(length) if length else b''
+                try:
+                    status, result = await respond(service, method, target, body)
+                except (KeyError, ValueError, TypeError) as e:
+                    status, result = 400, {'error': '{}: {}'.format(type(e).__name__, e)}
+                except Exception as e:                                       # E.g. a reload of a year whose zip file is missing (OSError)
+                    logger.exception('%s %s failed', method, target)
+                    status, result = 500, {'error': '{}: {}'.format(type(e).__name__, e)}
+
+            keep_alive = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+            content = to_json(result)
+            writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+                status, {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error'}[status], len(content),
+                'keep-alive' if keep_alive else 'close').encode() + content)
+            await writer.drain()
+            if not keep_alive or length > MAX_BODY:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service, host=HOST, port=PORT):
+
+    '''Serves the service over HTTP until cancelled.'''
+
+    server = await asyncio.start_server(lambda reader, writer: handle(service, reader, writer), host, port)
+    logger.info('serving %s traffic counts on http://%s:%s', service.counts.year, host, port)
+
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+
+    '''Entry point: python -m cycle_safety.service --year 2015 --data data/ --port 8765'''
+
+    parser = argparse.ArgumentParser(prog='python -m cycle_safety.service', description='Serves traffic estimates at points over HTTP.')
+    parser.add_argument('-y', '--year', type=int, default=2015, help='year of traffic counts to serve (default: %(default)s)')
+    parser.add_argument('-d', '--data', default=PATH, help='directory holding the downloaded DfT zip files (default: %(default)s)')
+    parser.add_argument('--host', default=HOST, help='address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=PORT, help='port to listen on (default: %(default)s)')
+    parser.add_argument('-k', type=int, default=K_NEAREST, help='number of count points each point is matched with (default: %(default)s)')
+    parser.add_argument('--weighting', choices=['relative','idw','nearest'], default=WEIGHTING, help='how the count points are weighted (default: %(default)s)')
+    parser.add_argument('--idw-power', type=float, default=IDW_POWER, help="power of the distance used by the 'idw' weighting (default: %(default)s)")
+    parser.add_argument('--lonlat', action='store_true', help='match in Lon / Lat degrees rather than BNG metres')
+    parser.add_argument('--max-distance', type=float, metavar='METRES', help='furthest a count point may be from a point (default: no limit)')
+    parser.add_argument('--fill-years', type=int, metavar='N', help='fill in the count points not surveyed in the year from the nearest year (up to N away)')
+    parser.add_argument('--growth', type=float, metavar='RATE', help='annual traffic growth applied to the counts filled in from other years')
+    parser.add_argument('--cache', metavar='DIR', help='take the cleaned traffic counts from (and keep them in) the cache in DIR')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+
+    cache = None
+    if args.cache:
+        from .cache import Cache
+        cache = Cache(args.cache)
+
+    service = TrafficService(args.year, args.data, not args.lonlat, args.k, args.weighting, args.idw_power, cache, args.max_distance, args.fill_years,
+                             args.growth)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
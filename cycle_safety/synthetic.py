@@ -0,0 +1,315 @@
+'''Synthetic AADF and STATS19 data with the same nested zip layout and columns as the DfT downloads, for timing the pipeline
+without the real data:
+
+    python -m cycle_safety.synthetic data/ --casualties 100000 --years 2015
+
+writes data/gb-road-traffic-counts.zip (data/AADF-data-major-roads.zip & data/AADF-data-minor-roads.zip inside) and
+data/road-accidents-safety-data.zip (data/DfTRoadSafety_Accidents_{year}.zip etc. inside).
+
+Named roads are straight lines across Great Britain with their Count Points spread along them and the Casualties on a named road
+are placed close to it, so the matching behaves much as it does on the real data. Everything is generated a chunk at a time and
+streamed into the zip files so 10M casualties fit in memory.'''
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from .loading import CASUALTIES_FILE, COUNTS_FILE, TC_FILES
+from .projection import bng_to_lonlat
+
+
+BOUNDS = (150000, 20000, 650000, 950000)                                     # Eastings / Northings the data is spread over
+CHUNK = 250000                                                               # Accidents generated (and written) at a time
+
+# Rough centres (BNG) of some of the Police Forces, each location is given the force with the nearest centre
+
+FORCE_CENTRES = {
+    1: (530000, 180000), 48: (532500, 181300), 3: (350000, 520000), 4: (360000, 430000), 5: (340000, 390000), 6: (385000, 400000),
+    10: (420000, 570000), 13: (420000, 430000), 20: (405000, 285000), 36: (610000, 310000), 42: (570000, 210000), 43: (460000, 200000),
+    44: (450000, 120000), 46: (590000, 150000), 47: (520000, 120000), 50: (250000, 80000), 52: (350000, 160000), 62: (300000, 190000),
+    95: (320000, 670000), 97: (260000, 660000)}
+
+ROAD_CLASS_CODES = {'M': 1, 'A': 3, 'B': 4, 'C': 5, 'U': 6}
+RCATS = {'M': 'TM', 'A': 'PR', 'B': 'BR', 'C': 'CR', 'U': 'UR'}
+
+TC_COLS = ['AADFYear','CP','ONS GOR Name','ONS LA Name','Road','RCat','S Ref E','S Ref N','A-Junction','B-Junction','LenNet','LenNet_miles',
+           'FdPC','Fd2WMV','FdCar','FdBUS','FdLGV','FdHGVR2','FdHGVR3','FdHGVR4','FdHGVA3','FdHGVA5','FdHGVA6','FdHGV','FdAll_MV']
+
+# Valid codes (including -1 for missing) of the STATS19 variables which are simply drawn at random
+
+CODES = {
+    'Accident_Severity': [1, 2, 3], 'Road_Type': [1, 2, 3, 6, 7, 9], 'Speed_limit': [20, 30, 40, 50, 60, 70],
+    'Junction_Detail': [0, 1, 2, 3, 5, 6, 7, 8, 9, -1], 'Junction_Control': [0, 1, 2, 3, 4, -1], '2nd_Road_Class': [-1, 3, 4, 5, 6],
+    'Pedestrian_Crossing-Human_Control': [0, 1, 2, -1], 'Pedestrian_Crossing-Physical_Facilities': [0, 1, 4, 5, 7, 8, -1],
+    'Light_Conditions': [1, 4, 5, 6, 7], 'Weather_Conditions': [1, 2, 3, 4, 5, 6, 7, 8, 9, -1], 'Road_Surface_Conditions': [1, 2, 3, 4, 5, -1],
+    'Special_Conditions_at_Site': [0, 1, 2, 3, 4, 5, 6, 7, -1], 'Carriageway_Hazards': [0, 1, 2, 3, 6, 7, -1], 'Urban_or_Rural_Area': [1, 2, 3],
+    'Did_Police_Officer_Attend_Scene_of_Accident': [1, 2, 3],
+    'Casualty_Class': [1, 2, 3], 'Sex_of_Casualty': [1, 2, -1], 'Casualty_Severity': [1, 2, 3], 'Pedestrian_Location': [0, 1, 5, 6, 10],
+    'Pedestrian_Movement': [0, 1, 3, 5, 9], 'Car_Passenger': [0, 1, 2], 'Bus_or_Coach_Passenger': [0, 1, 4], 'Pedestrian_Road_Maintenance_Worker': [0, 1, 2],
+    'Casualty_Type': [0, 1, 2, 3, 4, 5, 8, 9, 10, 11, 16, 17, 19, 20, 21, 22, 23, 90, 97, 98, 99], 'Casualty_Home_Area_Type': [1, 2, 3, -1],
+    'Casualty_IMD_Decile': list(range(1, 11)) + [-1],
+    'Vehicle_Type': [1, 2, 3, 4, 5, 8, 9, 10, 11, 19, 20, 21, 90, 98], 'Towing_and_Articulation': [0, 1, 2, 3, 4, 5], 'Vehicle_Manoeuvre': list(range(1, 19)),
+    'Junction_Location': list(range(0, 9)), 'Skidding_and_Overturning': [0, 1, 2, 3, 4, 5], 'Hit_Object_in_Carriageway': [0, 1, 2, 4, 5, 6, 7, 8, 9, 10, 11, 12],
+    'Vehicle_Leaving_Carriageway': list(range(0, 9)), 'Hit_Object_off_Carriageway': list(range(0, 12)), '1st_Point_of_Impact': [0, 1, 2, 3, 4],
+    'Was_Vehicle_Left_Hand_Drive?': [1, 2], 'Journey_Purpose_of_Driver': [1, 2, 3, 4, 5, 6, 15], 'Sex_of_Driver': [1, 2, 3],
+    'Propulsion_Code': [1, 2, 3, 8, -1], 'Driver_IMD_Decile': list(range(1, 11)) + [-1], 'Driver_Home_Area_Type': [1, 2, 3, -1]}
+
+ACC_RANDOM = ['Accident_Severity','Road_Type','Speed_limit','Junction_Detail','Junction_Control','2nd_Road_Class','Pedestrian_Crossing-Human_Control',
+              'Pedestrian_Crossing-Physical_Facilities','Light_Conditions','Weather_Conditions','Road_Surface_Conditions','Special_Conditions_at_Site',
+              'Carriageway_Hazards','Urban_or_Rural_Area','Did_Police_Officer_Attend_Scene_of_Accident']
+CAS_RANDOM = ['Casualty_Class','Sex_of_Casualty','Casualty_Severity','Pedestrian_Location','Pedestrian_Movement','Car_Passenger','Bus_or_Coach_Passenger',
+              'Pedestrian_Road_Maintenance_Worker','Casualty_Type','Casualty_Home_Area_Type','Casualty_IMD_Decile']
+VEH_RANDOM = ['Vehicle_Type','Towing_and_Articulation','Vehicle_Manoeuvre','Junction_Location','Skidding_and_Overturning','Hit_Object_in_Carriageway',
+              'Vehicle_Leaving_Carriageway','Hit_Object_off_Carriageway','1st_Point_of_Impact','Was_Vehicle_Left_Hand_Drive?','Journey_Purpose_of_Driver',
+              'Sex_of_Driver','Propulsion_Code','Driver_IMD_Decile','Driver_Home_Area_Type']
+
+
+def make_roads(rng, n_roads):
+
+    '''Creates the named roads (Motorways, A & B roads), each a straight line across GB. Returns their names, classes and end points.'''
+
+    classes = rng.choice(['M','A','B'], n_roads, p=[0.02, 0.55, 0.43])
+    names = np.empty(n_roads, dtype=object)
+    for road_class, first in [('M', 1), ('A', 1), ('B', 1000)]:
+        mask = classes == road_class
+        names[mask] = [road_class + str(first + i) for i in range(mask.sum())]
+
+    starts = rng.uniform(BOUNDS[:2], BOUNDS[2:], (n_roads, 2))
+    angles = rng.uniform(0, 2 * np.pi, n_roads)
+    lengths = np.where(classes == 'M', rng.uniform(50000, 300000, n_roads), rng.uniform(5000, 120000, n_roads))
+    ends = np.clip(starts + lengths[:, None] * np.column_stack([np.cos(angles), np.sin(angles)]), BOUNDS[:2], BOUNDS[2:])
+
+    return names, classes, starts, ends
+
+
+def make_count_points(rng, roads, n_major, n_minor):
+
+    '''Creates the Count Points: major ones spread along the named roads (in order, each covering the link between two junctions)
+    and minor ones ('C' and 'U' roads) scattered at random. About 0.2% have no location (recorded at the grid origin).'''
+
+    names, classes, starts, ends = roads
+    lengths = np.hypot(*(ends - starts).T)
+
+    road = np.sort(rng.choice(len(names), n_major, p=lengths / lengths.sum()))
+    t = rng.uniform(0, 1, n_major)
+    order = np.lexsort([t, road])                                            # Count Points in order along each road
+    road, t = road[order], t[order]
+
+    first = np.r_[True, road[1:] != road[:-1]]
+    position = np.arange(n_major) - np.maximum.accumulate(np.where(first, np.arange(n_major), 0))   # Position of the Count Point along its road
+    xy = starts[road] + t[:, None] * (ends[road] - starts[road])
+    road_names = names[road]
+
+    major = pd.DataFrame({
+        'CP': np.arange(1, n_major + 1), 'Road': road_names, 'RCat': [RCATS[c] for c in classes[road]],
+        'S Ref E': xy[:, 0].round().astype(int), 'S Ref N': xy[:, 1].round().astype(int),
+        'A-Junction': [name + ' J' + str(p) for name, p in zip(road_names, position)],
+        'B-Junction': [name + ' J' + str(p + 1) for name, p in zip(road_names, position)],
+        'LenNet': rng.uniform(0.3, 8, n_major).round(1)})
+
+    minor_class = rng.choice(['C','U'], n_minor, p=[0.3, 0.7])
+    minor_xy = rng.uniform(BOUNDS[:2], BOUNDS[2:], (n_minor, 2))
+    minor = pd.DataFrame({
+        'CP': np.arange(1, n_minor + 1) + 900000, 'Road': minor_class, 'RCat': [RCATS[c] for c in minor_class],
+        'S Ref E': minor_xy[:, 0].round().astype(int), 'S Ref N': minor_xy[:, 1].round().astype(int),
+        'A-Junction': '', 'B-Junction': '', 'LenNet': np.nan})
+
+    for df in (major, minor):
+        lost = rng.uniform(size=len(df)) < 0.002
+        df.loc[lost, ['S Ref E','S Ref N']] = 0
+        df['LenNet_miles'] = (df['LenNet'] * 0.621371).round(2)
+        df['ONS GOR Name'] = 'Region'
+        df['ONS LA Name'] = 'Authority'
+        df['Base'] = rng.lognormal(np.where(df['Road'].str[0] == 'M', 11, np.where(df['Road'].isin(['C','U']), 7, 9.3)), 0.6)
+
+    return major, minor
+
+
+def count_year(rng, cps, year):
+
+    '''The AADF rows of the Count Points for one year. About 8% of the Count Points aren't surveyed in any given year.'''
+
+    df = cps[rng.uniform(size=len(cps)) > 0.08].copy()
+    n = len(df)
+    mv = df['Base'].values * 1.01 ** (year - 2000) * rng.lognormal(0, 0.05, n)
+
+    df['AADFYear'] = year
+    df['FdCar'] = (mv * 0.78).round().astype(int)
+    df['Fd2WMV'] = (mv * 0.01).round().astype(int)
+    df['FdBUS'] = (mv * 0.01).round().astype(int)
+    df['FdLGV'] = (mv * 0.15).round().astype(int)
+    for col, share in [('FdHGVR2', 0.02), ('FdHGVR3', 0.004), ('FdHGVR4', 0.003), ('FdHGVA3', 0.002), ('FdHGVA5', 0.006), ('FdHGVA6', 0.015)]:
+        df[col] = (mv * share).round().astype(int)
+    df['FdHGV'] = df[['FdHGVR2','FdHGVR3','FdHGVR4','FdHGVA3','FdHGVA5','FdHGVA6']].sum(axis=1)
+    df['FdAll_MV'] = df[['FdCar','Fd2WMV','FdBUS','FdLGV','FdHGV']].sum(axis=1)
+    df['FdPC'] = (mv * rng.uniform(0.002, 0.05, n)).round().astype(int)
+
+    return df[TC_COLS]
+
+
+def make_accidents(rng, roads, year, start, n):
+
+    '''Creates n Accidents (Accident Indexes numbered from start): about a third on the named roads close to the road line,
+    the rest on 'C' / 'U' roads anywhere.'''
+
+    names, classes, starts, ends = roads
+    lengths = np.hypot(*(ends - starts).T)
+
+    on_named = rng.uniform(size=n) < 0.35
+    road = rng.choice(len(names), n, p=lengths / lengths.sum())
+    t = rng.uniform(0, 1, (n, 1))
+    xy = np.where(on_named[:, None], starts[road] + t * (ends[road] - starts[road]) + rng.normal(0, 30, (n, 2)),
+                  rng.uniform(BOUNDS[:2], BOUNDS[2:], (n, 2)))
+
+    minor_class = rng.choice(['C','U'], n, p=[0.15, 0.85])
+    road_class = np.where(on_named, classes[road], minor_class)
+    road_number = np.where(on_named, [int(name[1:]) for name in names[road]], 0)
+
+    centres = np.array(list(FORCE_CENTRES.values()))
+    force = np.array(list(FORCE_CENTRES))[np.argmin(((xy[:, None, :] - centres[None]) ** 2).sum(axis=2), axis=1)]
+    cell = (xy[:, 0] // 25000).astype(int) * 40 + (xy[:, 1] // 25000).astype(int)   # 25km grid cell, used as the Local Authority
+
+    lon, lat = bng_to_lonlat(xy[:, 0], xy[:, 1])
+    lost = rng.uniform(size=n) < 0.0005                                      # A few Accidents have no location
+    east, north = np.where(lost, np.nan, xy[:, 0].round()), np.where(lost, np.nan, xy[:, 1].round())
+    lon, lat = np.where(lost, np.nan, lon.round(6)), np.where(lost, np.nan, lat.round(6))
+
+    days = pd.Timestamp(year, 1, 1) + pd.to_timedelta(rng.integers(0, 365, n), unit='D')
+    minutes = rng.integers(0, 24 * 60, n)
+
+    df = pd.DataFrame({
+        '﻿Accident_Index': ['{}{:02d}{:07d}'.format(year, f, i) for f, i in zip(force, range(start, start + n))],
+        'Location_Easting_OSGR': east, 'Location_Northing_OSGR': north, 'Longitude': lon, 'Latitude': lat, 'Police_Force': force,
+        'Accident_Severity': 0, 'Number_of_Vehicles': 1 + rng.poisson(0.8, n), 'Number_of_Casualties': 1 + rng.poisson(0.3, n),
+        'Date': days.strftime('%d/%m/%Y'), 'Day_of_Week': (days.dayofweek.values + 1) % 7 + 1,
+        'Time': ['{:02d}:{:02d}'.format(m // 60, m % 60) for m in minutes],
+        'Local_Authority_(District)': 1 + cell % 941, 'Local_Authority_(Highway)': ['E{:08d}'.format(c) for c in cell],
+        '1st_Road_Class': [ROAD_CLASS_CODES[c] for c in road_class], '1st_Road_Number': road_number})
+
+    for col in ACC_RANDOM:
+        df[col] = rng.choice(CODES[col], n)
+    df['2nd_Road_Number'] = np.where(df['2nd_Road_Class'] == -1, 0, rng.integers(1, 9999, n))
+    df['LSOA_of_Accident_Location'] = ['E01{:06d}'.format(c) for c in rng.integers(0, 35000, n)]
+
+    return df[['﻿Accident_Index','Location_Easting_OSGR','Location_Northing_OSGR','Longitude','Latitude','Police_Force','Accident_Severity',
+               'Number_of_Vehicles','Number_of_Casualties','Date','Day_of_Week','Time','Local_Authority_(District)','Local_Authority_(Highway)',
+               '1st_Road_Class','1st_Road_Number','Road_Type','Speed_limit','Junction_Detail','Junction_Control','2nd_Road_Class','2nd_Road_Number',
+               'Pedestrian_Crossing-Human_Control','Pedestrian_Crossing-Physical_Facilities','Light_Conditions','Weather_Conditions',
+               'Road_Surface_Conditions','Special_Conditions_at_Site','Carriageway_Hazards','Urban_or_Rural_Area',
+               'Did_Police_Officer_Attend_Scene_of_Accident','LSOA_of_Accident_Location']]
+
+
+def make_people(rng, df_acc, count_col, reference, random_cols):
+
+    '''Creates the Casualty (or Vehicle) rows of the Accidents: one row per casualty (vehicle) numbered by reference.'''
+
+    counts = df_acc[count_col].values
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    df = pd.DataFrame({'﻿Accident_Index': np.repeat(df_acc['﻿Accident_Index'].values, counts),
+                       reference: np.arange(counts.sum()) - first + 1})
+    if reference == 'Casualty_Reference':
+        df.insert(1, 'Vehicle_Reference', 1)
+    for col in random_cols:
+        df[col] = rng.choice(CODES[col], len(df))
+    if reference == 'Casualty_Reference':
+        df.insert(6, 'Age_of_Casualty', rng.integers(0, 95, len(df)))
+        df.insert(7, 'Age_Band_of_Casualty', df['Age_of_Casualty'] // 10 + 1)
+    else:
+        df['Age_of_Driver'] = rng.integers(17, 90, len(df))
+        df['Engine_Capacity_(CC)'] = rng.integers(50, 3000, len(df))
+        df['Age_of_Vehicle'] = rng.integers(0, 20, len(df))
+
+    return df
+
+
+class NestedZip(object):
+
+    '''Writes csv files, each in a zip file of its own, into an outer zip file (the layout of the DfT downloads).
+    Each inner csv is streamed into a temporary zip file a chunk at a time so only one chunk is ever held in memory.'''
+
+    def __init__(self, file):
+
+        self.outer = zipfile.ZipFile(file, mode='w')
+        self.inner = {}
+
+    def write(self, name, df):
+
+        '''Appends a chunk of rows to the csv called name (writing the header with the first chunk).'''
+
+        if name not in self.inner:
+            buffer = tempfile.TemporaryFile()
+            archive = zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED)
+            stream = io.TextIOWrapper(archive.open(name + '.csv', mode='w', force_zip64=True), encoding='utf-8', newline='')
+            self.inner[name] = (buffer, archive, stream)
+            df.to_csv(stream, index=False)
+        else:
+            df.to_csv(self.inner[name][2], index=False, header=False)
+
+    def close(self):
+
+        '''Finishes each inner zip file and adds it to the outer zip file as data/name.zip.'''
+
+        for name, (buffer, archive, stream) in self.inner.items():
+            stream.close()
+            archive.close()
+            buffer.seek(0)
+            with self.outer.open('data/{}.zip'.format(name), mode='w', force_zip64=True) as inner:
+                shutil.copyfileobj(buffer, inner)
+            buffer.close()
+        self.outer.close()
+
+
+def generate(path, casualties=100000, years=(2015,), count_points=22000, seed=0):
+
+    '''Writes synthetic Traffic Count and Casualty zip files into the path directory.
+    count_points (about 80% major, 20% minor) are shared by every year, casualties is the number of casualties per year.'''
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(path, exist_ok=True)
+
+    roads = make_roads(rng, max(50, count_points // 8))
+    major, minor = make_count_points(rng, roads, count_points * 4 // 5, count_points - count_points * 4 // 5)
+
+    tc_zip = NestedZip(os.path.join(path, COUNTS_FILE))
+    for file, cps in zip(TC_FILES, (major, minor)):
+        for year in years:
+            tc_zip.write(file, count_year(rng, cps, year))
+    tc_zip.close()
+
+    cas_zip = NestedZip(os.path.join(path, CASUALTIES_FILE))
+    for year in years:
+        n_acc = max(1, int(round(casualties / 1.3)))                        # About 1.3 casualties per accident
+        for start in range(0, n_acc, CHUNK):
+            df_acc = make_accidents(rng, roads, year, start, min(CHUNK, n_acc - start))
+            cas_zip.write('DfTRoadSafety_Accidents_{}'.format(year), df_acc)
+            cas_zip.write('DfTRoadSafety_Casualties_{}'.format(year), make_people(rng, df_acc, 'Number_of_Casualties', 'Casualty_Reference', CAS_RANDOM))
+            cas_zip.write('DfTRoadSafety_Vehicles_{}'.format(year), make_people(rng, df_acc, 'Number_of_Vehicles', 'Vehicle_Reference', VEH_RANDOM))
+    cas_zip.close()
+
+
+def main(argv=None):
+
+    '''Command line entry point: python -m cycle_safety.synthetic PATH [options].'''
+
+    parser = argparse.ArgumentParser(prog='python -m cycle_safety.synthetic', description='Writes synthetic AADF and STATS19 zip files.')
+    parser.add_argument('path', help='directory to write the zip files to')
+    parser.add_argument('-c', '--casualties', type=int, default=100000, help='casualties per year (default: %(default)s)')
+    parser.add_argument('-y', '--years', type=int, nargs='+', default=[2015], help='years to create (default: %(default)s)')
+    parser.add_argument('--count-points', type=int, default=22000, help='number of count points (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    generate(args.path, args.casualties, args.years, args.count_points, args.seed)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+'''Fixtures shared by the tests: a small synthetic download (see cycle_safety.synthetic) generated once per session.'''
+
+import pandas as pd
+import pytest
+
+from cycle_safety.counts import CountIndex
+from cycle_safety.decoding import decode_casualties
+from cycle_safety.loading import TC_COUNTS, TC_DTYPES, load_casualties
+from cycle_safety.pipeline import clean_counts
+from cycle_safety.synthetic import generate
+
+
+YEAR = 2015                                                                  # Latest year of the synthetic data (the year before is there too)
+
+
+def raw_counts(*points):
+
+    '''Raw Traffic Counts (as load_counts loads them) of hand placed Count Points, each a dict of its CP, Road, S Ref E and S Ref N and
+    any other columns (AADFYear, A-Junction, B-Junction, LenNet or counts). The year is YEAR and every count is 100 unless given.'''
+
+    df_tc_raw = pd.DataFrame([{'AADFYear': YEAR, **{col: 100 for col in TC_COUNTS}, **point} for point in points]).reindex(columns=list(TC_DTYPES))
+    for col in ['Road','A-Junction','B-Junction']:
+        df_tc_raw[col] = df_tc_raw[col].astype('category')
+
+    return df_tc_raw
+
+
+@pytest.fixture(scope='session')
+def data(tmp_path_factory):
+
+    '''The directory of a synthetic download of YEAR and the year before: about 3000 Casualties a year and 2000 Count Points.'''
+
+    path = str(tmp_path_factory.mktemp('data'))
+    generate(path, casualties=3000, years=(YEAR - 1, YEAR), count_points=2000, seed=1)
+
+    return path
+
+
+@pytest.fixture(scope='session')
+def indexed(data):
+
+    '''The CountIndex (in BNG) and decoded Casualties of the synthetic YEAR.'''
+
+    return CountIndex(clean_counts(YEAR, data)), decode_casualties(load_casualties(data, YEAR))
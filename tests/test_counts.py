@@ -0,0 +1,33 @@
+'''Filling in a year's Traffic Counts from the nearest year each Count Point was surveyed (CountYears).'''
+
+from cycle_safety.counts import CountYears
+
+from conftest import YEAR, raw_counts
+
+
+def count_point(cp, road, year, count):
+
+    '''A Count Point's raw counts in a year, with every count set to count.'''
+
+    return {'CP': cp, 'Road': road, 'S Ref E': 400000 + cp, 'S Ref N': 300000, 'AADFYear': year, 'FdPC': count, 'FdAll_MV': count}
+
+
+def test_nearest_year_and_growth():
+
+    '''Each Count Point takes its counts from the year itself, else the nearest year within max_gap (the earlier on a tie), grown by the
+    rate of its Road Type. Count Points surveyed only outside max_gap are left out, and a Count Point listed twice in a year keeps its first row.'''
+
+    count_years = CountYears(raw_counts(count_point(1, 'A1', YEAR, 100), count_point(1, 'A1', YEAR - 2, 50),   # Surveyed in the year
+                                        count_point(2, 'A2', YEAR + 2, 300), count_point(2, 'A2', YEAR - 2, 200),   # 2 years either side
+                                        count_point(3, 'B3', YEAR - 1, 400),                                         # A year before, no growth
+                                        count_point(4, 'A4', YEAR - 5, 500),                                         # Outside max_gap
+                                        count_point(5, 'A5', YEAR, 600), count_point(5, 'A5', YEAR, 700)))           # Listed twice
+
+    df_tc_raw = count_years.year(YEAR, max_gap=2, growth={'A': 0.1}).set_index('CP')
+
+    assert df_tc_raw.index.tolist() == [1, 2, 3, 5]
+    assert df_tc_raw['AADFYear'].tolist() == [YEAR, YEAR - 2, YEAR - 1, YEAR]
+    assert df_tc_raw['FdPC'].tolist() == [100, 242, 400, 600]               # 200 grown by 1.1 ** 2
+
+    assert count_years.year(YEAR).index.size == 5                            # Any year held without max_gap
+    assert count_years.year(YEAR, max_gap=2)['FdPC'].tolist() == [100, 200, 400, 600]
@@ -0,0 +1,22 @@
+'''Saving the exposure-risk cube from the command line (--cube).'''
+
+import os
+
+from cycle_safety.cli import main
+from cycle_safety.cube import Cube
+
+from conftest import YEAR
+
+
+def test_cube_into_new_directory(data, tmp_path):
+
+    '''--cube saves into a directory which doesn't exist yet (nor does the output directory), for one year and for several.'''
+
+    out = str(tmp_path / 'out')
+    assert main(['-y', str(YEAR), '-d', data, '-o', out, '--all-forces', '--cube', os.path.join(out, 'cube.npz')]) == 0
+    assert main(['-y', str(YEAR), str(YEAR - 1), '-d', data, '-o', str(tmp_path / 'years'), '--processes', '1',
+                 '--cube', str(tmp_path / 'cubes' / 'cube.npz')]) == 0
+
+    cube = Cube.load(os.path.join(out, 'cube.npz'))
+    assert cube.casualties.sum() > 0
+    assert os.path.isfile(str(tmp_path / 'cubes' / 'cube_{}.npz'.format(YEAR)))
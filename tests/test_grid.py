@@ -0,0 +1,35 @@
+'''Matching through a LookupGrid against matching with the trees alone (knn_match without a grid).'''
+
+import pandas as pd
+import pytest
+
+from cycle_safety.grid import LookupGrid
+from cycle_safety.matching import knn_match
+
+
+K = 2
+
+
+@pytest.fixture(scope='module')
+def matching(indexed, tmp_path_factory):
+
+    '''The index and decoded Casualties of the synthetic year, with the index's grid saved and loaded back (memory-mapped).'''
+
+    index, df_cas = indexed
+    grid = LookupGrid.load(LookupGrid.build(index, K).save(str(tmp_path_factory.mktemp('grid'))), index)
+
+    return index, df_cas, grid
+
+
+@pytest.mark.parametrize('max_distance', [None, 2000])
+def test_grid_matches_trees(matching, max_distance):
+
+    '''The grid gives the trees' matches: the same Assign_Type's and Count Points, at the same distances.'''
+
+    index, df_cas, grid = matching
+    assert grid.safe.any()                                                   # Some points are matched from the grid itself
+
+    df_trees = knn_match(df_cas, index, K, max_distance=max_distance)
+    df_grid = knn_match(df_cas, index, K, grid=grid, max_distance=max_distance)
+
+    pd.testing.assert_frame_equal(df_grid, df_trees, check_exact=False, rtol=1e-9)
@@ -0,0 +1,48 @@
+'''The match quality and flags of interpolate_counts, and the distances in metres they're taken from (BNG and haversine).'''
+
+import numpy as np
+
+from cycle_safety.counts import CountIndex
+from cycle_safety.interpolation import MATCH_FLAGS, QUALITY_DISTANCE, interpolate_counts, match_quality
+from cycle_safety.matching import knn_match
+from cycle_safety.projection import bng_to_lonlat, haversine
+
+
+def test_match_quality():
+
+    '''Each match type has its quality on top of its Count Points, which falls by a factor of e for each QUALITY_DISTANCE of their weighted
+    distance. Points without a Count Point (or not matched at all) have no quality.'''
+
+    assign_types = np.array(['Road Link','Road Name','Road Type','Road Name','Road Type','Road Name','None'], dtype=object)
+    metres = np.array([[0, np.nan], [0, 0], [0, 0], [QUALITY_DISTANCE, 3 * QUALITY_DISTANCE], [2 * QUALITY_DISTANCE] * 2,
+                       [np.nan, np.nan], [np.nan, np.nan]])
+    weights = np.array([[1, np.nan], [0.5, 0.5], [0.5, 0.5], [0.5, 0.5], [0.5, 0.5], [np.nan, np.nan], [np.nan, np.nan]])
+    found = ~np.isnan(metres)
+
+    quality = match_quality(assign_types, metres, weights, found)
+    np.testing.assert_allclose(quality, [1, 0.9, 0.5, 0.9 * np.exp(-2), 0.5 * np.exp(-2), 0, 0])
+
+
+def test_flags_and_metres(indexed):
+
+    '''Matching in BNG, the metres are the distances and each matched Casualty is flagged with its match type alone. Matching in Lon / Lat,
+    the metres are haversine distances, within 1% of the BNG distances to the same Count Points (the grid's scale and the sphere).'''
+
+    index, df_cas = indexed
+    df_bng = knn_match(df_cas, index)
+    np.testing.assert_array_equal(df_bng[['Metres_1','Metres_2']].values, df_bng[['Distance_1','Distance_2']].values)
+
+    df_out = interpolate_counts(df_bng, index)
+    assert (df_out['Assign_Type'] != 'None').any()
+    for match, flag in MATCH_FLAGS.items():
+        assert df_out[flag].tolist() == (df_out['Assign_Type'] == match).tolist()
+    assert df_out['Match_Quality'].between(0, 1).all()
+    assert (df_out.loc[df_out['Assign_Type'] == 'None', 'Match_Quality'] == 0).all()
+
+    df_lonlat = knn_match(df_cas, CountIndex(index.df_tc, match_bng=False))
+    same = (df_lonlat['CP_Index_1'].values == df_bng['CP_Index_1'].values) & (df_bng['Metres_1'].values > 100)
+    assert same.sum() > len(df_bng) / 2
+    np.testing.assert_allclose(df_lonlat['Metres_1'].values[same], df_bng['Metres_1'].values[same], rtol=0.01)
+
+    lons, lats = bng_to_lonlat([400000, 400000], [300000, 310000])            # 10 km north along the grid's central meridian
+    np.testing.assert_allclose(haversine(lons[0], lats[0], lons[1], lats[1]), 10000, rtol=0.002)
@@ -0,0 +1,41 @@
+'''Snapping Casualties to the road link they're on (LinkIndex) on a hand built network.'''
+
+import numpy as np
+import pandas as pd
+
+from cycle_safety.counts import CountIndex, prepare_counts
+from cycle_safety.links import LinkIndex
+from cycle_safety.projection import bng_to_lonlat
+
+from conftest import raw_counts
+
+
+def test_snap_to_links():
+
+    '''A1 has two links of 2 km sharing junction J1, which is put halfway between their Count Points (at 402000), each with a stub of half
+    its length past its other junction. A2 is a single Count Point without junctions, close to A1 but kept apart from it. Each point is
+    snapped to the nearest segment of its own road, at its distance from the segment.'''
+
+    index = CountIndex(prepare_counts(raw_counts(
+        {'CP': 1, 'Road': 'A1', 'S Ref E': 400000, 'S Ref N': 300000, 'A-Junction': 'J0', 'B-Junction': 'J1', 'LenNet': 2.0},
+        {'CP': 2, 'Road': 'A1', 'S Ref E': 404000, 'S Ref N': 300000, 'A-Junction': 'J1', 'B-Junction': 'J2', 'LenNet': 2.0},
+        {'CP': 3, 'Road': 'A2', 'S Ref E': 401000, 'S Ref N': 300100})))
+    links = LinkIndex(index)
+    assert set(links.roads) == {'A1', 'A2'}
+
+    east, north, roads = zip((401000, 300300, 'A1'),                        # Off CP 1's link, 300 m (A2's Count Point is nearer)
+                             (402500, 299800, 'A1'),                        # Past the junction, on CP 2's link, 200 m
+                             (399500, 300000, 'A1'),                        # On CP 1's stub
+                             (405500, 300000, 'A1'),                        # 500 m past the end of CP 2's stub
+                             (401000, 300400, 'A2'),                        # 300 m from A2's Count Point
+                             (401000, 300300, 'A9'))                        # A road without links
+    points = np.column_stack(bng_to_lonlat(east, north))
+
+    dists, rows, linked = links.snap(points, pd.Series(roads))
+    assert linked.tolist() == [True] * 5 + [False]
+    assert rows[:5].tolist() == [0, 1, 0, 1, 2]
+    np.testing.assert_allclose(dists[:5], [300, 200, 0, 500, 300], atol=0.01)   # Within the projections' round trip
+
+    dists, rows, linked = links.snap(points, pd.Series(roads), max_distance=400)
+    assert linked.tolist() == [True, True, True, False, True, False]
+    assert np.isnan(rows[3]) and np.isnan(dists[3])
@@ -0,0 +1,39 @@
+'''Matching Casualties with their nearest Count Points (knn_match) on hand placed Count Points.'''
+
+import numpy as np
+import pandas as pd
+
+from cycle_safety.counts import CountIndex, prepare_counts
+from cycle_safety.matching import knn_match
+from cycle_safety.projection import bng_to_lonlat
+
+from conftest import raw_counts
+
+
+def casualties(*points):
+
+    '''Decoded Casualties (the columns knn_match uses) at BNG points, each an (Eastings, Northings, Road_Name, 1st_Road_Class).'''
+
+    east, north, names, classes = zip(*points)
+    lons, lats = bng_to_lonlat(east, north)
+
+    return pd.DataFrame({'Accident_Id': np.arange(len(points)), 'Road_Name': names, '1st_Road_Class': classes, 'Longitude': lons, 'Latitude': lats})
+
+
+def test_max_distance_cascade():
+
+    '''Beyond max_distance of every Count Point on its road a Casualty falls back to its Road Type, and beyond it of those too to 'None'.'''
+
+    index = CountIndex(prepare_counts(raw_counts({'CP': 1, 'Road': 'A1', 'S Ref E': 400000, 'S Ref N': 300000},
+                                                 {'CP': 2, 'Road': 'A2', 'S Ref E': 403500, 'S Ref N': 300000})))
+    df_cas = casualties((400500, 300000, 'A1', 'A'),                         # 500 m from A1's Count Point
+                        (403000, 300000, 'A1', 'A'),                         # 3 km from A1's, 500 m from A2's
+                        (400000, 320000, 'A1', 'A'))                         # 20 km from both
+
+    df_knn = knn_match(df_cas, index, max_distance=2000).set_index('Accident_Id')
+    assert df_knn['Assign_Type'].tolist() == ['Road Name', 'Road Type', 'None']
+    assert df_knn['CP_Index_1'].tolist()[:2] == [0, 1]
+    np.testing.assert_allclose(df_knn['Distance_1'].values[:2], [500, 500], atol=0.01)   # Within the projections' round trip
+    assert np.isnan(df_knn.loc[2, ['Distance_1','CP_Index_1']].values.astype(float)).all()
+
+    assert (knn_match(df_cas, index)['Assign_Type'] == 'Road Name').all()    # Without max_distance every Casualty is on its road
@@ -0,0 +1,21 @@
+'''Matching the road groups in a pool of processes (knn_match with processes) against matching them in this process.'''
+
+import pandas as pd
+import pytest
+
+from cycle_safety import matching
+from cycle_safety.matching import knn_match
+
+
+@pytest.mark.parametrize('max_distance', [None, 2000])
+def test_parallel_matches_serial(indexed, monkeypatch, max_distance):
+
+    '''Two processes give the same match table as one.'''
+
+    index, df_cas = indexed
+    monkeypatch.setattr(matching, 'PARALLEL_MIN', 0)                         # The synthetic year is too small to go to the pool otherwise
+
+    df_serial = knn_match(df_cas, index, max_distance=max_distance)
+    df_parallel = knn_match(df_cas, index, processes=2, max_distance=max_distance)
+
+    pd.testing.assert_frame_equal(df_parallel, df_serial)
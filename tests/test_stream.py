@@ -0,0 +1,46 @@
+'''Streaming a year (stream_year, written a block at a time by PartitionWriter) against the batch partitions (run with partition).'''
+
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from cycle_safety.pipeline import run, stream_year
+
+from conftest import YEAR
+
+
+def read_partitions(out, fmt):
+
+    '''The year's manifest entries (path & rows) and the dataframe of each partition, by path. Categorical columns are read as their values,
+    as each streamed block only has the categories it uses.'''
+
+    with open(os.path.join(out, 'year={}'.format(YEAR), 'manifest.json')) as f:
+        entries = [(entry['path'], entry['rows']) for entry in json.load(f)]
+
+    def read(path):
+        df = pd.read_parquet(path) if fmt == 'parquet' else pd.read_csv(path)
+        return df.astype({col: df[col].cat.categories.dtype for col in df if isinstance(df[col].dtype, pd.CategoricalDtype)})
+
+    return entries, {path: read(os.path.join(out, path)) for path, _ in entries}
+
+
+@pytest.mark.parametrize('fmt', ['csv.gz', 'parquet'])
+def test_stream_matches_batch(data, tmp_path, fmt):
+
+    '''Every partition streamed in blocks holds the same rows as the batch partition.'''
+
+    if fmt == 'parquet':
+        pytest.importorskip('pyarrow')
+
+    batch, stream = str(tmp_path / 'batch'), str(tmp_path / 'stream')
+    run(YEAR, data, batch, police_forces=None, partition=fmt)
+    stream_year(YEAR, data, stream, police_forces=None, partition=fmt, chunk_size=500)
+
+    batch_entries, batch_frames = read_partitions(batch, fmt)
+    stream_entries, stream_frames = read_partitions(stream, fmt)
+
+    assert stream_entries == batch_entries
+    for path, df in batch_frames.items():
+        pd.testing.assert_frame_equal(stream_frames[path], df)